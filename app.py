@@ -1,15 +1,19 @@
 # import streamlit as st
 import hmac, streamlit as st # used for password protection of app
-from rag.retriever import retrieve_topn
-from rag.composer import compose_grounded_answer, web_fallback_answer
-from rag.models import AnswerItem, CaseStudy, Chunk
-from rag.loader import upload_and_ingest
-from rag.store import ensure_indexes
-from config import EMBED_DIM, HYBRID_ACCEPT, ADMIN_PASSWORD
+import subprocess, sys
+from rag.chat import answer_turn
+from rag.session import ConversationContext
+from rag.models import SearchFilters
+from rag.history import ChatHistory, source_refs, full_text
+from rag.loader import upload_and_ingest, ingest_queue_panel
+from rag.store import list_facets, SEARCH_CACHE, CHUNK_CACHE
+from rag.indexes import ensure, validate, rebuild, index_rows, corpus_stats
+from rag.composer import EMBED_CACHE
+from config import EMBED_DIM, ADMIN_PASSWORD, HISTORY_PAGE, INGEST_AUTOSTART_WORKER
 ####################################################
-# these are required to view full graph db if needed
-# import streamlit.components.v1 as components
-# from rag.graph_explorer import render_graph_html
+# these are required to view the graph explorer (admin only)
+import streamlit.components.v1 as components
+from rag.graph_explorer import render_graph_html, fetch_page, count_case_studies
 ####################################################
 from urllib.parse import urlparse
 #####################################################
@@ -78,6 +82,33 @@ def _normalize_url(u: str | None) -> str | None:
     return u if urlparse(u).scheme else f"https://{u}"
 #############################################################
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _facets():
+    return list_facets()
+
+def search_scope_widget() -> SearchFilters:
+    facets = _facets()
+    with st.sidebar.expander("Search scope", expanded=False):
+        titles = {f["case_id"]: f["title"] for f in facets}
+        case_ids = st.multiselect("Case studies", options=list(titles), format_func=lambda c: titles.get(c, c))
+        industries = st.multiselect("Industries", options=sorted({f["industry"] for f in facets if f["industry"]}))
+        tags = st.multiselect("Tags", options=sorted({t for f in facets for t in f["tags"]}))
+        years = sorted({f["year"] for f in facets if f["year"]})
+        year_from = year_to = None
+        if len(years) > 1:
+            year_from, year_to = st.slider("Years", min_value=years[0], max_value=years[-1], value=(years[0], years[-1]))
+            if (year_from, year_to) == (years[0], years[-1]):
+                year_from = year_to = None
+    return SearchFilters(case_ids=case_ids, industries=industries, tags=tags, year_from=year_from, year_to=year_to)
+
+@st.cache_resource(show_spinner=False)
+def _ingest_worker():
+    # One background worker process per server; ingestion never runs in script threads
+    return subprocess.Popen([sys.executable, "-m", "rag.worker"])
+
+if INGEST_AUTOSTART_WORKER:
+    _ingest_worker()
+
 # Sidebar: Admin
 # with st.sidebar:
 #     st.header("Admin")
@@ -88,6 +119,44 @@ def _normalize_url(u: str | None) -> str | None:
 #     st.header("Upload Case Studies")
 #     upload_and_ingest()
 #     st.markdown("---")
+def show_index_issues(issues):
+    if not issues:
+        st.success("Indexes online and configured as expected.")
+    for i in issues:
+        (st.error if i["level"] == "error" else st.warning)(f"{i['index']}: {i['message']}")
+
+def index_health_panel():
+    with st.expander("Index health & corpus"):
+        if st.button("Check indexes"):
+            show_index_issues(validate(EMBED_DIM))
+            st.dataframe(
+                [{k: r[k] for k in ("name", "type", "state", "populationPercent")} for r in index_rows()],
+                hide_index=True,
+            )
+        if st.button("Corpus statistics"):
+            s = corpus_stats()
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Case studies", s["case_studies"])
+            c2.metric("Chunks", s["chunks"])
+            c3.metric("Avg chunk chars", f"{s['avg_chars'] or 0:.0f}")
+            st.caption(f"Embedded: {s['embedded']} · near-duplicates linked: {s['linked_duplicates']} · dimensions: "
+                       + (", ".join(f"{d} ({n})" for d, n in s["embedding_dims"].items()) or "none"))
+            if s["embedded"] + s["linked_duplicates"] < s["chunks"]:
+                st.warning(f"{s['chunks'] - s['embedded'] - s['linked_duplicates']} chunk(s) have no embedding.")
+            if s["orphan_chunks"]:
+                st.warning(f"{s['orphan_chunks']} orphaned chunk(s) with no case study, e.g. {', '.join(s['orphan_examples'][:3])}")
+            if s["empty_case_studies"]:
+                st.warning(f"{s['empty_case_studies']} case stud(ies) without chunks.")
+            if s["duplicate_chunks"]:
+                st.warning(f"{s['duplicate_chunks']} chunk(s) repeat text found elsewhere "
+                           f"({s['duplicate_groups']} group(s)), e.g. {' = '.join(s['duplicate_examples'][0])}")
+        kind = st.selectbox("Index to rebuild", ["vector", "fulltext"])
+        if st.button("Rebuild index"):
+            # Searches keep using the current index until the new one is online
+            with st.spinner(f"Building a new {kind} index…"):
+                name = rebuild(kind, EMBED_DIM)
+            st.success(f"Searches now use {name}.")
+
 # Sidebar: Admin
 with st.sidebar:
     st.header("Admin")
@@ -98,147 +167,105 @@ with st.sidebar:
     # Only show admin tools if logged in
     if st.session_state.get("is_admin"):
         if st.button("Ensure Indexes"):
-            ensure_indexes(EMBED_DIM)
-            st.success("Indexes ensured.")
+            # Creates what is missing, waits until every index is ONLINE, then validates the setup
+            with st.spinner("Creating indexes and waiting for them to come online…"):
+                show_index_issues(ensure(EMBED_DIM))
+        index_health_panel()
+
+        with st.expander("Shared caches"):
+            for c in (EMBED_CACHE, SEARCH_CACHE, CHUNK_CACHE):
+                stats = c.stats()
+                st.caption(f"{stats['name']}: {stats['entries']} entries, "
+                           f"{stats['bytes'] / 2**20:.1f} MB, {stats['hits']} hits / {stats['misses']} misses")
 
         st.markdown("---")
         st.header("Upload Case Studies")
         upload_and_ingest()
+        st.subheader("Ingestion queue")
+        if INGEST_AUTOSTART_WORKER:
+            worker = _ingest_worker()
+            if worker.poll() is not None:
+                st.error(f"Ingestion worker exited (code {worker.returncode}). Restart the app to relaunch it.")
+        ingest_queue_panel()
         st.markdown("---")
     else:
         st.info("Admin tools are locked. Please log in above to manage indexes or upload case studies.")
 
     #################################################
-    # This will display full db graph
-    # st.subheader("Graph Explorer")
-    # max_nodes = st.slider("Max nodes to visualize", min_value=100, max_value=5000, value=1000, step=100,
-    #                       help="Limits how many nodes are pulled to keep the view responsive.")
-    # if st.button("Render full graph (capped)"):
-    #     with st.spinner("Building graph…"):
-    #         html_path = render_graph_html(max_nodes=max_nodes)
-    #         # Display interactive graph
-    #         with open(html_path, "r", encoding="utf-8") as f:
-    #             components.html(f.read(), height=820, scrolling=True)
-    #         # Optional: let admins download the HTML
-    #         with open(html_path, "rb") as fbin:
-    #             st.download_button(
-    #                 "Download graph HTML",
-    #                 data=fbin,
-    #                 file_name="neo4j_graph.html",
-    #                 mime="text/html",
-    #             )
-    # st.caption("Note: This view caps the number of nodes to avoid memory issues on large databases.")
+    # Graph explorer: pages CaseStudy neighborhoods instead of pulling the whole graph
+    if st.session_state.get("is_admin"):
+        st.subheader("Graph Explorer")
+        cases_per_page = st.slider("Case studies per page", min_value=5, max_value=100, value=25, step=5)
+        chunks_per_case = st.slider("Chunks per case study", min_value=0, max_value=50, value=5)
+        n_pages = max(1, -(-count_case_studies() // cases_per_page))
+        page = st.number_input("Page", min_value=1, max_value=n_pages, value=1) - 1
+        page_cases = fetch_page(page, cases_per_page, 0)
+        expanded = st.multiselect(
+            "Expand case studies",
+            options=[r["case_id"] for r in page_cases],
+            format_func=lambda cid: next((r["title"] for r in page_cases if r["case_id"] == cid), cid),
+            help="Loads the remaining chunks of the selected case studies.",
+        )
+        if st.button("Render graph"):
+            st.session_state["graph_view"] = True
+        if st.session_state.get("graph_view"):
+            with st.spinner("Building graph…"):
+                graph_html = render_graph_html(page, cases_per_page, chunks_per_case, expanded)
+            components.html(graph_html, height=820, scrolling=True)
+            st.download_button(
+                "Download graph HTML",
+                data=graph_html,
+                file_name="neo4j_graph.html",
+                mime="text/html",
+            )
+        st.caption("Note: Only lightweight properties are loaded; embeddings and full chunk text stay in the database.")
     #################################################
 
 # Chat panel
 st.title("Conexus AI Search")
-if "history" not in st.session_state:
-    st.session_state.history = []
+if not isinstance(st.session_state.get("history"), ChatHistory):
+    st.session_state.history = ChatHistory()
+if "convo" not in st.session_state:
+    st.session_state.convo = ConversationContext()
 
+filters = search_scope_widget()
 user_q = st.chat_input("Ask about the case studies…")
 if user_q:
-    top, best = retrieve_topn(user_q)
-    if top and best >= HYBRID_ACCEPT:
-        answer = compose_grounded_answer(user_q, top)
-        grounded = True
-        ext_link = None
-    else:
-        answer, ext_link = web_fallback_answer(user_q)
-        grounded = False
-    # Heuristic: if grounded answer basically says "no info in the data",
-    # flip it to not grounded so we don't display sources.
-    if grounded:
-        ans_lower = answer.lower()
-        no_info_phrases = [
-            # chunks / case studies
-            "the provided chunks do not contain information",
-            "the provided chunks do not contain any information",
-            "the provided chunks do not include information",
-            "no relevant information was found in the provided chunks",
-            "the case studies do not contain information",
-            "the case studies do not include information",
-            # database wording
-            "not present in the database",
-            "no information regarding",
-            "no information about",
-        ]
-
-        if any(p in ans_lower for p in no_info_phrases):
-            grounded = False
-
+    turn = answer_turn(user_q, st.session_state.convo, filters)
 
-    # top3_items = []
-    # for c in (top or [])[:3]:
-    #     top3_items.append(AnswerItem(
-    #         answer_snippet=c['text'][:220] + ('…' if len(c['text'])>220 else ''),
-    #         score=round(float(c['hybrid']), 3),
-    #         case_study=CaseStudy(case_id=c['case_id'], title=c['title'], url=c['url']),
-    #         chunk=Chunk(chunk_id=c['cid'], text=c['text'], order=int(c['order']),
-    #                     char_start=int(c['start']), char_end=int(c['end']))
-    #     ))
-    # Only show top3 sources when the answer is grounded in the DB
-    top3_items = []
-    if grounded and top:
-        for c in top[:3]:
-            top3_items.append(AnswerItem(
-                answer_snippet=c['text'][:220] + ('…' if len(c['text']) > 220 else ''),
-                score=round(float(c['hybrid']), 3),
-                case_study=CaseStudy(case_id=c['case_id'], title=c['title'], url=c['url']),
-                chunk=Chunk(
-                    chunk_id=c['cid'],
-                    text=c['text'],
-                    order=int(c['order']),
-                    char_start=int(c['start']),
-                    char_end=int(c['end']),
-                ),
-            ))
-    
+    # Only keep sources when the answer is grounded in the DB; history stores
+    # chunk references + snippets, full text is fetched when a source is opened.
+    st.session_state.history.append(
+        user_q, turn["answer"], turn["grounded"], turn["external_link"], source_refs(turn["top"]),
+    )
 
-    st.session_state.history.append({
-        "q": user_q,
-        "resp": {
-            "answer": answer,
-            "top3": [i.model_dump() for i in top3_items],
-            "grounded_in_db": grounded,
-            "external_link": ext_link
-        }
-    })
+def render_source(turn_id: int, i: int, item: dict):
+    with st.expander(f"Source {i}: {item['title']}"):
+        st.write(item['snippet'])
+        if st.checkbox("Show full text", key=f"full_{turn_id}_{i}"):
+            st.write(full_text(item['chunk_id']) or "(chunk no longer in the database)")
+        st.caption(
+            f"chunk_id={item['chunk_id']} "
+            f"range={item['char_start']}-{item['char_end']}"
+        )
+        url = _normalize_url(item.get("url"))
+        if url:
+            try:
+                st.link_button("Open case study ↗", url)
+            except Exception:
+                st.markdown(
+                    f'<a href="{url}" target="_blank" rel="noopener noreferrer">Open case study ↗</a>',
+                    unsafe_allow_html=True,
+                )
 
-# for turn in st.session_state.history:
-#     st.chat_message("user").write(turn["q"])
-#     with st.chat_message("assistant"):
-#         st.write(turn["resp"]["answer"])
-#         if turn["resp"]["grounded_in_db"]:
-#             st.caption("Grounded in Conexus MRG Case Studies (top 3)")
-#         else:
-#             st.caption("Not found in Conexus MRG Case Studies")
-#             if turn["resp"].get("external_link"):
-#                 st.markdown(f"External source: {turn['resp']['external_link']}")
-#         for i, item in enumerate(turn["resp"]["top3"], start=1):
-#             #with st.expander(f"Source {i}: {item['case_study']['title']} (score {item['score']})"): # SHOW SCORE
-#             with st.expander(f"Source {i}: {item['case_study']['title']}"):
-#                 # Chunk text
-#                 st.write(item['chunk']['text'])
+# Only the latest page of turns is rendered, so a rerun costs the same however long the session is
+history = st.session_state.history
+visible = st.session_state.get("history_visible", HISTORY_PAGE)
+if len(history) > visible:
+    if st.button(f"Show earlier turns ({len(history) - visible} hidden)"):
+        st.session_state["history_visible"] = visible = visible + HISTORY_PAGE
 
-#                 # Metadata (without raw url=...)
-#                 st.caption(
-#                     f"chunk_id={item['chunk']['chunk_id']} "
-#                     f"range={item['chunk']['char_start']}-{item['chunk']['char_end']}"
-#                 )
-
-#                 # Clickable link to the case study (opens in a new tab)
-#                 url = _normalize_url(item["case_study"].get("url"))
-#                 if url:
-#                     # Streamlit 1.52 supports link_button; fallback to HTML if anything odd happens
-#                     try:
-#                         st.link_button("Open case study ↗", url)
-#                     except Exception:
-#                         st.markdown(
-#                             f'<a href="{url}" target="_blank" rel="noopener noreferrer">Open case study ↗</a>',
-#                             unsafe_allow_html=True,
-#                         )
-
-for turn in st.session_state.history:
+for turn in history.latest(visible):
     st.chat_message("user").write(turn["q"])
     with st.chat_message("assistant"):
         st.write(turn["resp"]["answer"])
@@ -247,25 +274,10 @@ for turn in st.session_state.history:
             st.caption("Grounded in Conexus MRG Case Studies (top 3)")
 
             # Only show sources when grounded
-            for i, item in enumerate(turn["resp"]["top3"], start=1):
-                with st.expander(f"Source {i}: {item['case_study']['title']}"):
-                    st.write(item['chunk']['text'])
-                    st.caption(
-                        f"chunk_id={item['chunk']['chunk_id']} "
-                        f"range={item['chunk']['char_start']}-{item['chunk']['char_end']}"
-                    )
-                    url = _normalize_url(item["case_study"].get("url"))
-                    if url:
-                        try:
-                            st.link_button("Open case study ↗", url)
-                        except Exception:
-                            st.markdown(
-                                f'<a href="{url}" target="_blank" rel="noopener noreferrer">Open case study ↗</a>',
-                                unsafe_allow_html=True,
-                            )
+            for i, item in enumerate(turn["resp"]["sources"], start=1):
+                render_source(turn["id"], i, item)
         else:
             st.caption("Not found in Conexus MRG Case Studies")
             if turn["resp"].get("external_link"):
                 st.markdown(f"External source: {turn['resp']['external_link']}")
             # No source panels in the non-grounded case
-
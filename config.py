@@ -17,6 +17,7 @@ def _get(key, default=None):
 OPENAI_API_KEY = _get("OPENAI_API_KEY", "")
 OPENAI_PROJECT_ID = _get("OPENAI_PROJECT_ID")
 OPENAI_ORG_ID = _get("OPENAI_ORG_ID")
+OPENAI_BASE_URL = _get("OPENAI_BASE_URL")  # e.g. the load-test fake server; unset = api.openai.com
 # Models (override in Secrets if you like)
 EMBED_MODEL = _get("EMBED_MODEL", "text-embedding-3-small")
 CHAT_MODEL = _get("CHAT_MODEL", "gpt-4o-mini")  # was 'gpt-5-reasoning' which 404s for many accounts
@@ -24,11 +25,57 @@ CHAT_MODEL = _get("CHAT_MODEL", "gpt-4o-mini")  # was 'gpt-5-reasoning' which 40
 NEO4J_URI = _get("NEO4J_URI")
 NEO4J_USER = _get("NEO4J_USER")
 NEO4J_PASSWORD = _get("NEO4J_PASSWORD")
+NEO4J_MAX_POOL = int(_get("NEO4J_MAX_POOL", 100))  # connections per process
 # Retrieval tuning
 EMBED_DIM = int(_get("EMBED_DIM", 1536))
 HYBRID_ACCEPT = float(_get("HYBRID_ACCEPT", 0.35))
 TOP_K = int(_get("TOP_K", 8))
 TOP_N = int(_get("TOP_N", 3))
+# Context expansion: neighbors on each side of a hit, and total chars sent to the LLM
+CONTEXT_NEIGHBORS = int(_get("CONTEXT_NEIGHBORS", 1))
+CONTEXT_CHARS = int(_get("CONTEXT_CHARS", 6000))
+# Query expansion: LLM rewrites / HyDE passage searched alongside the question (0 / false = off)
+QUERY_REWRITES = int(_get("QUERY_REWRITES", 0))
+QUERY_HYDE = _get("QUERY_HYDE", "false").lower() in ("1","true","yes")
+QUERY_BUDGET_S = float(_get("QUERY_BUDGET_S", 2.0))
+# Conversation-aware retrieval: turns used to condense follow-ups, cached chunks kept
+# per session, and the cosine a cached chunk needs to answer without a new search
+CONVO_TURNS = int(_get("CONVO_TURNS", 3))
+WARM_POOL_SIZE = int(_get("WARM_POOL_SIZE", 24))
+WARM_ACCEPT = float(_get("WARM_ACCEPT", 0.45))
+# Questions up to this many words (or with back-references like "it", "the second one")
+# are condensed with the conversation; others are searched as asked, saving an LLM call
+FOLLOW_UP_MAX_WORDS = int(_get("FOLLOW_UP_MAX_WORDS", 6))
+# Chat history: turns kept per session, and turns rendered per page
+HISTORY_MAX_TURNS = int(_get("HISTORY_MAX_TURNS", 100))
+HISTORY_PAGE = int(_get("HISTORY_PAGE", 10))
+# Process-wide caches (per cache memory budget in MB, entry lifetime, and how
+# often the ingestion version counter is re-read from Neo4j)
+CACHE_EMBED_MB = int(_get("CACHE_EMBED_MB", 64))
+CACHE_SEARCH_MB = int(_get("CACHE_SEARCH_MB", 64))
+CACHE_CHUNK_MB = int(_get("CACHE_CHUNK_MB", 128))
+CACHE_TTL_S = float(_get("CACHE_TTL_S", 3600))
+INDEX_VERSION_TTL_S = float(_get("INDEX_VERSION_TTL_S", 5))
+# Ingestion queue (SQLite file shared by the app and the worker process)
+JOBS_DB = _get("JOBS_DB", "ingest_jobs.sqlite3")
+JOB_POLL_S = float(_get("JOB_POLL_S", 2))
+JOB_STALE_S = float(_get("JOB_STALE_S", 600))
+JOB_MAX_ATTEMPTS = int(_get("JOB_MAX_ATTEMPTS", 3))
+INGEST_AUTOSTART_WORKER = _get("INGEST_AUTOSTART_WORKER", "true").lower() in ("1","true","yes")
+# OCR fallback for scanned PDF pages (needs Tesseract installed): pages with fewer
+# extracted characters than OCR_MIN_CHARS are OCRed in a pool of OCR_WORKERS processes
+OCR_ENABLED = _get("OCR_ENABLED", "true").lower() in ("1","true","yes")
+OCR_MIN_CHARS = int(_get("OCR_MIN_CHARS", 25))
+# One core is left for the app: the worker may run inside the web container
+OCR_WORKERS = int(_get("OCR_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+OCR_DPI = int(_get("OCR_DPI", 300))
+OCR_LANG = _get("OCR_LANG", "eng")
+OCR_CACHE_DIR = _get("OCR_CACHE_DIR", "ocr_cache")
+# Near-duplicate chunks at ingest: MinHash Jaccard at or above DEDUP_THRESHOLD over
+# DEDUP_SHINGLE-word shingles links a chunk to an existing one instead of embedding it
+DEDUP_ENABLED = _get("DEDUP_ENABLED", "true").lower() in ("1","true","yes")
+DEDUP_THRESHOLD = float(_get("DEDUP_THRESHOLD", 0.85))
+DEDUP_SHINGLE = int(_get("DEDUP_SHINGLE", 5))
 # -----------------------
 # Admin
 # -----------------------
@@ -0,0 +1,147 @@
+"""
+Local stand-in for the OpenAI API used by the load test.
+
+    python -m loadtest.fake_openai --port 8099 --embed-latency-ms 40 --chat-latency-ms 800 --rps 50
+
+Serves /v1/embeddings and /v1/chat/completions with configurable latency and
+a token-bucket rate limit (429 + Retry-After when exceeded). Embeddings are
+deterministic hashed bag-of-words vectors, so texts that share words land
+close together and vector search behaves sensibly against a seeded corpus.
+"""
+import argparse, hashlib, json, random, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+import numpy as np
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    vec = np.zeros(dim, dtype=np.float32)
+    for tok in re.findall(r"\w+", text.lower()):
+        h = int.from_bytes(hashlib.blake2b(tok.encode(), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = float(np.linalg.norm(vec))
+    return (vec / norm if norm else vec).tolist()
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.stamp = burst, time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class FakeOpenAI:
+    """Server state: settings plus counters the load test reads at the end."""
+
+    def __init__(self, dim: int = 1536, embed_latency_ms: float = 40, chat_latency_ms: float = 800,
+                 jitter: float = 0.25, rps: float = 0, burst: Optional[float] = None):
+        self.dim = dim
+        self.embed_latency = embed_latency_ms / 1000
+        self.chat_latency = chat_latency_ms / 1000
+        self.jitter = jitter
+        self.bucket = TokenBucket(rps, burst or max(rps, 1))
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    def _sleep(self, base: float):
+        time.sleep(max(0.0, random.gauss(base, base * self.jitter)))
+
+    def handle(self, path: str, body: Dict):
+        # Returns (status, payload)
+        if path.endswith("/embeddings"):
+            self._sleep(self.embed_latency)
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            dim = int(body.get("dimensions") or self.dim)
+            return 200, {
+                "object": "list",
+                "model": body.get("model", "fake-embed"),
+                "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(t, dim)}
+                         for i, t in enumerate(inputs)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        if path.endswith("/chat/completions"):
+            self._sleep(self.chat_latency)
+            last = body["messages"][-1]["content"]
+            if (body.get("response_format") or {}).get("type") == "json_object":
+                # Covers query rewriting and follow-up condensation
+                question = last.rsplit("Follow-up:", 1)[-1].strip()
+                content = json.dumps({"rewrites": [question], "passage": "", "question": question, "follow_up": False})
+            else:
+                content = "Based on the sources, here is a concise answer. [1]"
+            return 200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake-chat"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        return 404, {"error": {"message": f"{path} is not served by the fake", "type": "invalid_request_error"}}
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                with fake.lock:
+                    fake.stats["requests"] += 1
+                    fake.stats["in_flight"] += 1
+                    fake.stats["peak_in_flight"] = max(fake.stats["peak_in_flight"], fake.stats["in_flight"])
+                try:
+                    if not fake.bucket.take():
+                        with fake.lock:
+                            fake.stats["rate_limited"] += 1
+                        status, payload, headers = 429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"Retry-After": "1"}
+                    else:
+                        (status, payload), headers = fake.handle(self.path, body), {}
+                finally:
+                    with fake.lock:
+                        fake.stats["in_flight"] -= 1
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+        return server
+
+def add_args(ap: argparse.ArgumentParser):
+    ap.add_argument("--dim", type=int, default=1536, help="embedding size (match EMBED_DIM)")
+    ap.add_argument("--embed-latency-ms", type=float, default=40)
+    ap.add_argument("--chat-latency-ms", type=float, default=800)
+    ap.add_argument("--jitter", type=float, default=0.25, help="latency std-dev as a fraction of the mean")
+    ap.add_argument("--rps", type=float, default=0, help="rate limit in requests/sec (0 = unlimited)")
+    ap.add_argument("--burst", type=float, default=None, help="token bucket size (default: rps)")
+
+def from_args(args: argparse.Namespace) -> FakeOpenAI:
+    return FakeOpenAI(args.dim, args.embed_latency_ms, args.chat_latency_ms, args.jitter, args.rps, args.burst)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Fake OpenAI API for load tests.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    add_args(ap)
+    args = ap.parse_args()
+    server = from_args(args).serve(args.host, args.port)
+    print(f"fake OpenAI listening on http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    threading.Event().wait()
@@ -0,0 +1,235 @@
+"""
+Load test: N concurrent virtual users driving the app's chat path
+(rag.chat.answer_turn) against a fake OpenAI server and a local Neo4j.
+
+    docker run -d -p 7687:7687 -e NEO4J_AUTH=neo4j/loadtest123 neo4j:5
+    python -m loadtest.run --seed 200 --users 20 --duration 60
+    python -m loadtest.run --restore corpus.parquet --users 20   # real corpus, see rag.snapshot
+
+The fake server runs in-process unless --openai-url points at one started
+separately (python -m loadtest.fake_openai). Reports throughput, per-stage
+latency percentiles and histograms, errors by stage, Neo4j pool usage and
+how often the fake rate limit was hit.
+"""
+import argparse, os, random, sys, tempfile, threading, time
+from collections import Counter, defaultdict
+from typing import Dict, List
+import numpy as np
+from loadtest import fake_openai
+
+INDUSTRIES = ["retail", "fintech", "healthcare", "logistics", "energy", "media"]
+TOPICS = [
+    "demand forecasting", "fraud detection", "customer churn", "route optimization",
+    "recommendation engine", "document search", "supply chain risk", "knowledge graph",
+    "anomaly detection", "pricing model",
+]
+OUTCOMES = [
+    "reduced costs by 18 percent", "cut response times in half", "improved recall on audits",
+    "raised conversion by 7 percent", "replaced a manual weekly report", "shortened onboarding",
+]
+QUESTIONS = [
+    "How was {topic} used in {industry}?",
+    "What results did the {topic} project deliver?",
+    "Which case studies mention {topic}?",
+    "What data sources fed the {industry} {topic} work?",
+]
+FOLLOW_UPS = ["What were the results?", "Which tools did they use?", "How long did it take?"]
+
+def synthetic_case(i: int, rnd: random.Random) -> Dict:
+    industry, topic = rnd.choice(INDUSTRIES), rnd.choice(TOPICS)
+    paras = []
+    for p in range(rnd.randint(3, 8)):
+        paras.append(
+            f"Case {i} part {p}. A {industry} team built a {topic} pipeline on a graph database. "
+            f"They combined {rnd.choice(TOPICS)} with {rnd.choice(TOPICS)} and {rnd.choice(OUTCOMES)}. "
+            + " ".join(rnd.choice(TOPICS + OUTCOMES) for _ in range(40))
+        )
+    return {
+        "meta": {"case_id": f"load-{i:05d}", "title": f"{industry.title()} {topic} #{i}",
+                 "url": f"https://example.com/load/{i}", "industry": industry,
+                 "year": rnd.randint(2015, 2025), "tags": [topic]},
+        "text": "\n\n".join(paras),
+    }
+
+def seed(n_cases: int, dim: int):
+    from rag.aio import run
+    from rag.loader import chunk_records, aingest_records
+    from rag.indexes import await_indexes
+    from rag.store import ensure_indexes, bump_index_version
+
+    rnd = random.Random(7)
+    ensure_indexes(dim)
+    t0, total = time.perf_counter(), 0
+    for i in range(n_cases):
+        case = synthetic_case(i, rnd)
+        recs = chunk_records(case["text"], case["meta"])
+        run(aingest_records(recs))
+        total += len(recs)
+    await_indexes()
+    bump_index_version()
+    print(f"seeded {n_cases} cases / {total} chunks in {time.perf_counter() - t0:.1f}s", flush=True)
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.turns = 0
+        self.grounded = 0
+
+    def ok(self, timings: Dict[str, float], total: float, grounded: bool):
+        with self.lock:
+            for stage, secs in timings.items():
+                self.stages[stage].append(secs)
+            self.stages["turn"].append(total)
+            self.turns += 1
+            self.grounded += grounded
+
+    def error(self, timings: Dict[str, float], exc: Exception):
+        # _timed records a stage even when it raises, so the last key is where it failed
+        stage = next(reversed(timings), "retrieve") if timings else "retrieve"
+        with self.lock:
+            self.errors[(stage, type(exc).__name__)] += 1
+
+def virtual_user(uid: int, stop: threading.Event, rec: Recorder, think: float, follow_up_rate: float):
+    from rag.chat import answer_turn
+    from rag.session import ConversationContext
+
+    rnd = random.Random(uid)
+    convo = ConversationContext()
+    while not stop.is_set():
+        if convo.turns and rnd.random() < follow_up_rate:
+            q = rnd.choice(FOLLOW_UPS)
+        else:
+            convo = ConversationContext()  # a fresh conversation
+            q = rnd.choice(QUESTIONS).format(topic=rnd.choice(TOPICS), industry=rnd.choice(INDUSTRIES))
+        timings: Dict[str, float] = {}
+        t0 = time.perf_counter()
+        try:
+            turn = answer_turn(q, convo, timings=timings)
+            rec.ok(timings, time.perf_counter() - t0, turn["grounded"])
+        except Exception as e:
+            rec.error(timings, e)
+        if think:
+            stop.wait(rnd.expovariate(1 / think))
+
+def sample_pool(stop: threading.Event, samples: List[Dict], every: float = 0.25):
+    from rag.store import pool_stats
+    while not stop.wait(every):
+        samples.append(pool_stats())
+
+def histogram(values: List[float], bins: int = 10, width: int = 40) -> List[str]:
+    arr = np.asarray(values) * 1000
+    counts, edges = np.histogram(arr, bins=bins)
+    top = max(int(counts.max()), 1)
+    return [f"    {edges[i]:8.0f}-{edges[i + 1]:<8.0f}ms {'#' * round(width * c / top):<{width}} {c}"
+            for i, c in enumerate(counts)]
+
+def report(rec: Recorder, elapsed: float, pool: List[Dict], fake: fake_openai.FakeOpenAI = None):
+    from rag.composer import EMBED_CACHE
+    from rag.store import SEARCH_CACHE, CHUNK_CACHE, pool_stats
+
+    errors = sum(rec.errors.values())
+    attempts = rec.turns + errors
+    print(f"\n== {rec.turns} turns in {elapsed:.1f}s: {rec.turns / elapsed:.2f} turns/s, "
+          f"{rec.grounded} grounded, error rate {errors / max(attempts, 1):.1%}")
+    print("\n== latency by stage (ms)")
+    print(f"  {'stage':<10}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    order = ["retrieve", "expand", "compose", "fallback", "turn"]
+    for stage in sorted(rec.stages, key=lambda s: order.index(s) if s in order else len(order)):
+        ms = np.asarray(rec.stages[stage]) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        print(f"  {stage:<10}{len(ms):>7}{p50:>9.0f}{p95:>9.0f}{p99:>9.0f}{ms.max():>9.0f}")
+    for stage in ("retrieve", "compose", "turn"):
+        if rec.stages.get(stage):
+            print(f"\n  {stage}:")
+            print("\n".join(histogram(rec.stages[stage])))
+    if rec.errors:
+        print("\n== errors")
+        for (stage, kind), n in rec.errors.most_common():
+            print(f"  {stage:<10}{kind:<30}{n:>6}")
+    stats = pool_stats()
+    in_flight = [s["in_flight"] for s in pool] or [0]
+    print(f"\n== neo4j pool: max_size {stats['max_size']}, peak sessions {stats['peak']} "
+          f"({stats['peak'] / stats['max_size']:.0%}), mean {np.mean(in_flight):.1f}, "
+          f"saturated {np.mean([s['in_flight'] >= s['max_size'] for s in pool] or [0]):.0%} of samples")
+    print("\n== caches")
+    for c in (EMBED_CACHE, SEARCH_CACHE, CHUNK_CACHE):
+        s = c.stats()
+        print(f"  {s['name']:<12} hit rate {s['hits'] / max(s['hits'] + s['misses'], 1):.0%} ({s['entries']} entries)")
+    if fake is not None:
+        s = fake.stats
+        print(f"\n== fake openai: {s['requests']} requests, {s['rate_limited']} rate-limited (429), "
+              f"peak {s['peak_in_flight']} concurrent")
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent chat load test against local stand-ins.")
+    ap.add_argument("--users", type=int, default=10)
+    ap.add_argument("--duration", type=float, default=60, help="seconds of load after ramp-up")
+    ap.add_argument("--ramp", type=float, default=5, help="seconds to start all users")
+    ap.add_argument("--think", type=float, default=1.0, help="mean think time between turns (s)")
+    ap.add_argument("--follow-ups", type=float, default=0.3, help="chance a turn is a follow-up")
+    ap.add_argument("--seed", type=int, default=0, help="ingest N synthetic cases first")
+    ap.add_argument("--restore", default=None, help="import a corpus snapshot (rag.snapshot) first")
+    ap.add_argument("--openai-url", default=None, help="use a fake server already running here")
+    ap.add_argument("--neo4j-uri", default="bolt://localhost:7687")
+    ap.add_argument("--neo4j-user", default="neo4j")
+    ap.add_argument("--neo4j-password", default="loadtest123")
+    fake_openai.add_args(ap)
+    args = ap.parse_args()
+
+    fake = None
+    if args.openai_url is None:
+        fake = fake_openai.from_args(args)
+        server = fake.serve()
+        args.openai_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    # config is read at import time, so point it at the stand-ins before importing rag
+    os.environ.update({
+        "OPENAI_BASE_URL": args.openai_url,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY") or "sk-loadtest",
+        "NEO4J_URI": args.neo4j_uri,
+        "NEO4J_USER": args.neo4j_user,
+        "NEO4J_PASSWORD": args.neo4j_password,
+        "EMBED_DIM": str(args.dim),
+        # Seeding runs dedup, which records signatures in JOBS_DB; keep them out of the real queue
+        "JOBS_DB": os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "jobs.db"),
+    })
+    import config
+    # Streamlit secrets win over the environment in config._get; never load-test (or seed) production
+    overridden = [key for key in ("NEO4J_URI", "OPENAI_BASE_URL", "JOBS_DB")
+                  if getattr(config, key) != os.environ[key]]
+    if overridden:
+        print(f"refusing to run: .streamlit/secrets.toml overrides {', '.join(overridden)} of the load-test stand-ins; "
+              "move the secrets file aside and run again", file=sys.stderr)
+        return 2
+    if args.seed:
+        seed(args.seed, args.dim)
+    if args.restore:
+        from rag.indexes import await_indexes
+        from rag.snapshot import import_snapshot
+        t0 = time.perf_counter()
+        n = import_snapshot(args.restore)
+        await_indexes()
+        print(f"restored {n} chunks from {args.restore} in {time.perf_counter() - t0:.1f}s", flush=True)
+
+    rec, stop, pool = Recorder(), threading.Event(), []
+    threads = [threading.Thread(target=sample_pool, args=(stop, pool), daemon=True)]
+    threads[0].start()
+    t0 = time.perf_counter()
+    for uid in range(args.users):
+        t = threading.Thread(target=virtual_user, args=(uid, stop, rec, args.think, args.follow_ups), daemon=True)
+        t.start()
+        threads.append(t)
+        time.sleep(args.ramp / max(args.users, 1))
+    try:
+        stop.wait(args.duration)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for t in threads:
+        t.join(timeout=30)
+    report(rec, time.perf_counter() - t0, pool, fake)
+    return 1 if not rec.turns else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+import asyncio, threading
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    The process-wide event loop all Neo4j and OpenAI I/O runs on. It lives in
+    one daemon thread, so Streamlit script threads only block on a future
+    while many requests share the same connections.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="rag-io", daemon=True).start()
+            _loop = loop
+    return _loop
+
+def run(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    # Sync adapter for existing call sites. Never call it from a coroutine on
+    # the shared loop itself: await the coroutine directly there.
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
@@ -0,0 +1,81 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from config import HYBRID_ACCEPT
+from .aio import run
+from .composer import acompose_grounded_answer, aweb_fallback_answer
+from .context import aexpand_context
+from .models import SearchFilters
+from .session import ConversationContext, aretrieve_with_context
+
+# Heuristic: if grounded answer basically says "no info in the data",
+# flip it to not grounded so we don't display sources.
+NO_INFO_PHRASES = [
+    # chunks / case studies
+    "the provided chunks do not contain information",
+    "the provided chunks do not contain any information",
+    "the provided chunks do not include information",
+    "no relevant information was found in the provided chunks",
+    "the case studies do not contain information",
+    "the case studies do not include information",
+    # database wording
+    "not present in the database",
+    "no information regarding",
+    "no information about",
+]
+
+@contextmanager
+def _timed(timings: Optional[Dict[str, float]], stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = time.perf_counter() - t0
+
+async def aanswer_turn(
+    user_q: str,
+    convo: ConversationContext,
+    filters: Optional[SearchFilters] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> Dict:
+    """
+    One chat turn as the app runs it: retrieve (conversation-aware), then a
+    grounded answer over the expanded hits or the web/general fallback.
+    `timings`, if given, receives seconds per stage (retrieve, expand,
+    compose or fallback). The turn is remembered in `convo`.
+    """
+    # Follow-ups are condensed with recent turns and may be served from this session's cached chunks
+    with _timed(timings, "retrieve"):
+        top, best, standalone_q = await aretrieve_with_context(user_q, convo, filters)
+    if top and best >= HYBRID_ACCEPT:
+        # Sources stay the precise hits; the LLM sees them widened with neighboring chunks
+        with _timed(timings, "expand"):
+            passages = await aexpand_context(top)
+        with _timed(timings, "compose"):
+            answer = await acompose_grounded_answer(standalone_q, passages)
+        grounded = True
+        ext_link = None
+    else:
+        with _timed(timings, "fallback"):
+            answer, ext_link = await aweb_fallback_answer(standalone_q)
+        grounded = False
+    if grounded and any(p in answer.lower() for p in NO_INFO_PHRASES):
+        grounded = False
+
+    convo.remember(standalone_q, answer, top if grounded else [])
+    return {
+        "answer": answer,
+        "grounded": grounded,
+        "external_link": ext_link,
+        "top": top if grounded else [],
+        "standalone_q": standalone_q,
+    }
+
+def answer_turn(
+    user_q: str,
+    convo: ConversationContext,
+    filters: Optional[SearchFilters] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> Dict:
+    return run(aanswer_turn(user_q, convo, filters, timings))
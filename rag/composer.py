@@ -1,17 +1,78 @@
+import json
 from typing import List, Optional, Tuple
-from openai import OpenAI
-from config import OPENAI_API_KEY, OPENAI_PROJECT_ID, OPENAI_ORG_ID, CHAT_MODEL, EMBED_MODEL, WEB_SEARCH_ENABLED
-
-client = OpenAI(
-    api_key=OPENAI_API_KEY,
-    project=OPENAI_PROJECT_ID if OPENAI_PROJECT_ID else None,
-    organization=OPENAI_ORG_ID if OPENAI_ORG_ID else None,
-)
+import numpy as np
+from openai import AsyncOpenAI
+from config import (OPENAI_API_KEY, OPENAI_PROJECT_ID, OPENAI_ORG_ID, OPENAI_BASE_URL, CHAT_MODEL,
+                    EMBED_MODEL, WEB_SEARCH_ENABLED, CACHE_EMBED_MB, CACHE_TTL_S)
+from .aio import run
+from .cache import TTLCache, normalize_query
+
+# One async client on the shared I/O loop (rag.aio); every public function has
+# an `a`-prefixed coroutine and a sync adapter for Streamlit call sites.
+_client: Optional[AsyncOpenAI] = None
+
+def get_client() -> AsyncOpenAI:
+    # Created lazily so its HTTP connection pool binds to the shared loop
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            project=OPENAI_PROJECT_ID if OPENAI_PROJECT_ID else None,
+            organization=OPENAI_ORG_ID if OPENAI_ORG_ID else None,
+            base_url=OPENAI_BASE_URL if OPENAI_BASE_URL else None,
+        )
+    return _client
 
 # --- Embeddings ---
+# Query embeddings are shared by every session in the process
+EMBED_CACHE = TTLCache("embeddings", CACHE_EMBED_MB * 2**20, CACHE_TTL_S)
+
+async def aembed_query(q: str) -> List[float]:
+    key = (EMBED_MODEL, normalize_query(q))
+    vec = EMBED_CACHE.get(key)
+    if vec is None:
+        emb = await get_client().embeddings.create(model=EMBED_MODEL, input=q)
+        vec = np.asarray(emb.data[0].embedding, dtype=np.float32)
+        EMBED_CACHE.set(key, vec)
+    return vec.tolist()
+
+async def aembed_texts(texts: List[str]) -> List[List[float]]:
+    # One request for many inputs; results come back tagged with their input index.
+    # Not cached: used for ingestion and one-off rewrites.
+    emb = await get_client().embeddings.create(model=EMBED_MODEL, input=texts)
+    return [d.embedding for d in sorted(emb.data, key=lambda d: d.index)]
+
 def embed_query(q: str) -> List[float]:
-    emb = client.embeddings.create(model=EMBED_MODEL, input=q)
-    return emb.data[0].embedding
+    return run(aembed_query(q))
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    return run(aembed_texts(texts))
+
+# --- Query expansion ---
+REWRITE_PROMPT = """
+You rewrite search questions for a database of consulting case studies.
+Return JSON: {"rewrites": [...], "passage": "..."}.
+"rewrites": up to {n} short standalone search queries that rephrase the question with likely domain terms.
+"passage": {passage}
+"""
+
+async def arewrite_query(question: str, n: int, hyde: bool, timeout: float) -> Tuple[List[str], Optional[str]]:
+    prompt = REWRITE_PROMPT.replace("{n}", str(n)).replace(
+        "{passage}",
+        "a 2-3 sentence passage, written as if taken from a case study, that answers the question." if hyde else "empty string.",
+    )
+    res = await get_client().with_options(timeout=timeout, max_retries=0).chat.completions.create(
+        model=CHAT_MODEL,
+        messages=[{"role": "system", "content": prompt}, {"role": "user", "content": question}],
+        response_format={"type": "json_object"},
+    )
+    data = json.loads(res.choices[0].message.content or "{}")
+    rewrites = [r.strip() for r in data.get("rewrites", []) if isinstance(r, str) and r.strip()][:n]
+    passage = (data.get("passage") or "").strip() if hyde else ""
+    return rewrites, (passage or None)
+
+def rewrite_query(question: str, n: int, hyde: bool, timeout: float) -> Tuple[List[str], Optional[str]]:
+    return run(arewrite_query(question, n, hyde, timeout))
 
 # --- Answer composition (grounded) ---
 PROMPT = """
@@ -24,7 +85,7 @@ Return a concise answer.
 
 """
 
-def compose_grounded_answer(question: str, chunks: List[dict]) -> str:
+async def acompose_grounded_answer(question: str, chunks: List[dict]) -> str:
     sources = "\n\n".join([
 
         f"[{i+1}] {c['title']} (chunk {c['cid']} range {c['start']}-{c['end']}):\n{c['text']}" for i,c in enumerate(chunks)
@@ -38,12 +99,39 @@ def compose_grounded_answer(question: str, chunks: List[dict]) -> str:
 
     ]
 
-    res = client.chat.completions.create(model=CHAT_MODEL, messages=messages)
+    res = await get_client().chat.completions.create(model=CHAT_MODEL, messages=messages)
 
     return res.choices[0].message.content
 
+def compose_grounded_answer(question: str, chunks: List[dict]) -> str:
+    return run(acompose_grounded_answer(question, chunks))
+
+# --- Follow-up condensation ---
+CONDENSE_PROMPT = """
+You turn a follow-up question from a chat about consulting case studies into a standalone search question.
+Use the conversation to resolve references like "it", "that project" or "the second one".
+Return JSON: {"question": "<standalone question>", "follow_up": <true if it is about the previous answers or their sources, else false>}
+"""
+
+async def acondense_question(question: str, turns: List[Tuple[str, str]]) -> Tuple[str, bool]:
+    convo = "\n\n".join(f"User: {q}\nAssistant: {a[:600]}" for q, a in turns)
+    res = await get_client().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=[
+            {"role": "system", "content": CONDENSE_PROMPT},
+            {"role": "user", "content": f"Conversation:\n{convo}\n\nFollow-up: {question}"},
+        ],
+        response_format={"type": "json_object"},
+    )
+    data = json.loads(res.choices[0].message.content or "{}")
+    standalone = (data.get("question") or "").strip() or question
+    return standalone, bool(data.get("follow_up"))
+
+def condense_question(question: str, turns: List[Tuple[str, str]]) -> Tuple[str, bool]:
+    return run(acondense_question(question, turns))
+
 # --- Web fallback (optional) ---
-def web_fallback_answer(question: str) -> Tuple[str, Optional[str]]:
+async def aweb_fallback_answer(question: str) -> Tuple[str, Optional[str]]:
 
     if not WEB_SEARCH_ENABLED:
 
@@ -57,13 +145,13 @@ def web_fallback_answer(question: str) -> Tuple[str, Optional[str]]:
 
         ]
 
-        res = client.chat.completions.create(model=CHAT_MODEL, messages=msg)
+        res = await get_client().chat.completions.create(model=CHAT_MODEL, messages=msg)
 
         return ("Not found in Neo4j. " + res.choices[0].message.content, None)
 
     try:
 
-        res = client.responses.create(
+        res = await get_client().responses.create(
 
             model=CHAT_MODEL,
 
@@ -109,7 +197,9 @@ def web_fallback_answer(question: str) -> Tuple[str, Optional[str]]:
 
         ]
 
-        res = client.chat.completions.create(model=CHAT_MODEL, messages=msg)
+        res = await get_client().chat.completions.create(model=CHAT_MODEL, messages=msg)
 
         return ("Not found in Neo4j. " + res.choices[0].message.content, None)
 
+def web_fallback_answer(question: str) -> Tuple[str, Optional[str]]:
+    return run(aweb_fallback_answer(question))
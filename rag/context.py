@@ -0,0 +1,80 @@
+from typing import Dict, List
+from config import CONTEXT_NEIGHBORS, CONTEXT_CHARS
+from .aio import run
+from .store import aneighbors
+
+def _select(top: List[Dict], rows: List[Dict], k: int, budget: int) -> Dict[str, Dict[int, Dict]]:
+    # Hits always go in; neighbors are added nearest-first, best hit first, until the budget is spent.
+    by_hit: Dict[str, List[Dict]] = {}
+    for r in rows:
+        by_hit.setdefault(r['hit_id'], []).append(r)
+
+    picked: Dict[str, Dict[int, Dict]] = {}
+    used = 0
+    for c in top:
+        picked.setdefault(c['case_id'], {})[int(c['order'])] = {
+            'text': c['text'], 'ord': int(c['order']), 's': int(c['start']), 'e': int(c['end'])}
+        used += len(c['text'])
+    for dist in range(1, k + 1):
+        for c in top:
+            chosen = picked[c['case_id']]
+            for r in by_hit.get(c['cid'], []):
+                ord_ = int(r['ord'])
+                if abs(ord_ - int(c['order'])) != dist or ord_ in chosen:
+                    continue
+                if used + len(r['text']) > budget:
+                    continue
+                chosen[ord_] = {'text': r['text'], 'ord': ord_, 's': int(r['s']), 'e': int(r['e'])}
+                used += len(r['text'])
+    return picked
+
+def _merge(chunks: List[Dict]) -> List[Dict]:
+    # Consecutive chunks overlap by design; stitch them using their char offsets.
+    spans: List[Dict] = []
+    for ch in sorted(chunks, key=lambda x: x['ord']):
+        last = spans[-1] if spans else None
+        if last and ch['ord'] == last['last_ord'] + 1 and ch['s'] <= last['e']:
+            last['text'] += ch['text'][last['e'] - ch['s']:]
+            last['e'] = max(last['e'], ch['e'])
+            last['last_ord'] = ch['ord']
+        else:
+            spans.append({'text': ch['text'], 's': ch['s'], 'e': ch['e'],
+                          'first_ord': ch['ord'], 'last_ord': ch['ord']})
+    return spans
+
+async def aexpand_context(top: List[Dict], k: int = CONTEXT_NEIGHBORS, budget: int = CONTEXT_CHARS) -> List[Dict]:
+    """
+    Widens the retrieved hits with up to `k` neighboring chunks on each side
+    (one batched query), merges overlapping/adjacent chunks into passages and
+    keeps the total text under `budget` characters. Returns passages in the
+    shape compose_grounded_answer expects, ordered by their best hit.
+    """
+    if not top or k <= 0:
+        return top
+    rows = await aneighbors([c['cid'] for c in top], k)
+    picked = _select(top, rows, k, budget)
+
+    passages: List[Dict] = []
+    seen = set()
+    for c in top:
+        for span in _merge(list(picked[c['case_id']].values())):
+            key = (c['case_id'], span['first_ord'])
+            if key in seen or not (span['first_ord'] <= int(c['order']) <= span['last_ord']):
+                continue
+            seen.add(key)
+            cid = c['cid'] if span['first_ord'] == span['last_ord'] else \
+                f"{c['case_id']}-{span['first_ord']:04d}..{span['last_ord']:04d}"
+            passages.append({
+                'hybrid': c['hybrid'],
+                'cid': cid,
+                'case_id': c['case_id'],
+                'title': c['title'],
+                'url': c['url'],
+                'text': span['text'],
+                'start': span['s'],
+                'end': span['e'],
+            })
+    return passages
+
+def expand_context(top: List[Dict], k: int = CONTEXT_NEIGHBORS, budget: int = CONTEXT_CHARS) -> List[Dict]:
+    return run(aexpand_context(top, k, budget))
@@ -0,0 +1,239 @@
+import argparse, hashlib, re, time
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from config import DEDUP_THRESHOLD, DEDUP_SHINGLE
+from .aio import run
+from .store import afetch
+from . import jobs
+
+# Near-duplicate chunks (boilerplate company blurbs, disclaimers) are detected
+# with MinHash over word shingles and LSH banding. Signatures of canonical
+# chunks live next to the ingestion queue in JOBS_DB; a duplicate is stored
+# with dup_of + DUPLICATE_OF instead of being embedded and indexed again.
+# Chunks loaded outside the app (the Neo4J/ notebook) are added with:
+#
+#     python -m rag.dedup seed
+NUM_PERM = 128
+BANDS, ROWS = 16, 8      # candidates from ~0.7 Jaccard; DEDUP_THRESHOLD decides
+MAX_CANDIDATES = 50
+_PRIME = np.uint64(4294967311)   # > 2**32, so (a*x + b) mod p is a universal hash of 32-bit shingles
+_rng = np.random.RandomState(20240607)   # fixed: signatures must stay comparable across runs
+_A = _rng.randint(1, 2**31, size=(NUM_PERM, 1)).astype(np.uint64)
+_B = _rng.randint(0, 2**31, size=(NUM_PERM, 1)).astype(np.uint64)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS minhash (
+    chunk_id TEXT PRIMARY KEY,
+    sig BLOB NOT NULL                    -- NUM_PERM x uint32
+);
+CREATE TABLE IF NOT EXISTS lsh (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    chunk_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lsh_bucket_idx ON lsh(band, bucket);
+CREATE INDEX IF NOT EXISTS lsh_chunk_idx ON lsh(chunk_id);
+CREATE TABLE IF NOT EXISTS duplicates (   -- clusters: every member points at its canonical chunk
+    chunk_id TEXT PRIMARY KEY,
+    dup_of TEXT NOT NULL,
+    similarity REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS duplicates_of_idx ON duplicates(dup_of);
+"""
+
+def _connect():
+    con = jobs.connect()
+    con.executescript(SCHEMA)
+    return con
+
+def signature(text: str, k: int = DEDUP_SHINGLE) -> Optional[np.ndarray]:
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + k]) for i in range(max(1, len(words) - k + 1))}
+    x = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+    return ((_A * x + _B) % _PRIME).min(axis=1).astype(np.uint32)
+
+def _buckets(sig: np.ndarray) -> List[Tuple[int, int]]:
+    return [(b, int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), "little", signed=True))
+            for b, band in enumerate(sig.reshape(BANDS, ROWS))]
+
+def _similarity(sig: np.ndarray, others: np.ndarray) -> np.ndarray:
+    return (others == sig).mean(axis=1)
+
+class Deduper:
+    """
+    Marks duplicates in a job's chunk records, batch by batch. Canonical
+    chunks are registered only once their batch is committed to Neo4j
+    (commit), so a failed job never leaves others pointing at missing
+    chunks; until then they are matched from memory.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.pending: Dict[str, np.ndarray] = {}
+        self.sigs: Dict[str, np.ndarray] = {}
+
+    def _match(self, con, chunk_id: str, sig: np.ndarray) -> Tuple[Optional[str], float]:
+        buckets = _buckets(sig)
+        rows = con.execute(
+            "SELECT DISTINCT m.chunk_id, m.sig FROM lsh l JOIN minhash m ON m.chunk_id = l.chunk_id "
+            f"WHERE (l.band, l.bucket) IN (VALUES {', '.join(['(?, ?)'] * len(buckets))}) AND l.chunk_id != ? "
+            f"LIMIT {MAX_CANDIDATES}",
+            [v for bb in buckets for v in bb] + [chunk_id],
+        ).fetchall()
+        ids = [r["chunk_id"] for r in rows]
+        mats = [np.frombuffer(r["sig"], dtype=np.uint32) for r in rows]
+        for cid, s in self.pending.items():
+            if cid != chunk_id:
+                ids.append(cid); mats.append(s)
+        if not ids:
+            return None, 0.0
+        sims = _similarity(sig, np.stack(mats))
+        best = int(np.argmax(sims))
+        return (ids[best], float(sims[best])) if sims[best] >= self.threshold else (None, 0.0)
+
+    def mark(self, recs: List[dict]):
+        # Sets rec["dup_of"] to the canonical chunk_id, or None
+        con = _connect()
+        try:
+            for r in recs:
+                sig = signature(r["text"])
+                r["dup_of"] = None
+                if sig is None:
+                    continue
+                dup_of, sim = self._match(con, r["chunk_id"], sig)
+                if dup_of is None:
+                    self.pending[r["chunk_id"]] = self.sigs[r["chunk_id"]] = sig
+                else:
+                    r["dup_of"], r["dup_similarity"] = dup_of, sim
+        finally:
+            con.close()
+
+    def stored_matches(self, recs: List[dict]) -> List[str]:
+        # Canonical ids matched from JOBS_DB rather than from this job's pending chunks
+        return sorted({r["dup_of"] for r in recs if r.get("dup_of") and r["dup_of"] not in self.pending})
+
+    def forget(self, chunk_ids: List[str]):
+        # Drops canonical chunks that are gone from Neo4j (cleared or a different database)
+        con = _connect()
+        try:
+            con.execute("BEGIN")
+            for cid in chunk_ids:
+                con.execute("DELETE FROM lsh WHERE chunk_id = ?", (cid,))
+                con.execute("DELETE FROM minhash WHERE chunk_id = ?", (cid,))
+                con.execute("DELETE FROM duplicates WHERE chunk_id = ?", (cid,))
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    def register(self, recs: List[dict]):
+        # For records whose dup_of is already decided (snapshot import): index the canonical ones
+        for r in recs:
+            if not r.get("dup_of"):
+                sig = signature(r["text"])
+                if sig is not None:
+                    self.sigs[r["chunk_id"]] = sig
+        self.commit(recs)
+
+    def commit(self, recs: List[dict]):
+        # Called after the batch is written; re-ingested chunk_ids replace their old entries
+        now = time.time()
+        con = _connect()
+        try:
+            con.execute("BEGIN")
+            for r in recs:
+                cid = r["chunk_id"]
+                con.execute("DELETE FROM lsh WHERE chunk_id = ?", (cid,))
+                con.execute("DELETE FROM minhash WHERE chunk_id = ?", (cid,))
+                con.execute("DELETE FROM duplicates WHERE chunk_id = ?", (cid,))
+                if r.get("dup_of"):
+                    # Links restored from a snapshot carry no score; they met the threshold when made
+                    con.execute("INSERT INTO duplicates (chunk_id, dup_of, similarity, created_at) VALUES (?, ?, ?, ?)",
+                                (cid, r["dup_of"], r.get("dup_similarity", self.threshold), now))
+                elif cid in self.sigs:
+                    sig = self.sigs.pop(cid)
+                    con.execute("INSERT INTO minhash (chunk_id, sig) VALUES (?, ?)", (cid, sig.tobytes()))
+                    con.executemany("INSERT INTO lsh (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                                    [(b, h, cid) for b, h in _buckets(sig)])
+                self.pending.pop(cid, None)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+SEED_PAGE = 1000
+
+# Canonical (not linked) chunks, keyset-paginated on chunk_id
+SEED_PAGE_QUERY = """
+MATCH (c:Chunk)
+WHERE c.chunk_id > $after AND c.dup_of IS NULL
+WITH c ORDER BY c.chunk_id LIMIT $limit
+RETURN c.chunk_id AS chunk_id, c.text AS text
+"""
+
+async def aseed(page: int = SEED_PAGE, on_page: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Registers every canonical chunk already in Neo4j, so uploads are matched
+    against the existing corpus. Safe to re-run; returns the chunk count.
+    """
+    deduper = Deduper()
+    n, after = 0, ""
+    while True:
+        rows = await afetch(SEED_PAGE_QUERY, after=after, limit=page)
+        if not rows:
+            return n
+        deduper.register([{**r, "text": r["text"] or ""} for r in rows])
+        n += len(rows)
+        after = rows[-1]["chunk_id"]
+        if on_page:
+            on_page(n)
+
+def seed(page: int = SEED_PAGE) -> int:
+    return run(aseed(page))
+
+def dedup_stats(top: int = 5) -> Dict:
+    con = _connect()
+    try:
+        canonical = con.execute("SELECT count(*) AS n FROM minhash").fetchone()["n"]
+        dups = con.execute("SELECT count(*) AS n FROM duplicates").fetchone()["n"]
+        clusters = con.execute(
+            "SELECT dup_of, count(*) AS members FROM duplicates GROUP BY dup_of ORDER BY members DESC LIMIT ?", (top,)
+        ).fetchall()
+        n_clusters = con.execute("SELECT count(DISTINCT dup_of) AS n FROM duplicates").fetchone()["n"]
+    finally:
+        con.close()
+    return {"canonical": canonical, "duplicates": dups, "clusters": n_clusters,
+            "largest": [dict(r) for r in clusters]}
+
+def cluster(chunk_id: str) -> List[str]:
+    # The canonical chunk followed by its duplicates
+    con = _connect()
+    try:
+        row = con.execute("SELECT dup_of FROM duplicates WHERE chunk_id = ?", (chunk_id,)).fetchone()
+        canon = row["dup_of"] if row else chunk_id
+        members = [r["chunk_id"] for r in con.execute(
+            "SELECT chunk_id FROM duplicates WHERE dup_of = ? ORDER BY chunk_id", (canon,))]
+    finally:
+        con.close()
+    return [canon] + members
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Near-duplicate index maintenance.")
+    ap.add_argument("command", choices=["seed", "stats"])
+    args = ap.parse_args()
+    if args.command == "seed":
+        t0 = time.perf_counter()
+        n = run(aseed(on_page=lambda n: print(f"  registered {n} chunks", flush=True)))
+        print(f"registered {n} chunks in {time.perf_counter() - t0:.1f}s")
+    else:
+        print(dedup_stats())
@@ -1,94 +1,174 @@
-from __future__ import annotations
-from typing import List, Dict
-from neo4j import GraphDatabase
-from pyvis.network import Network
-import json, os, tempfile
-from config import NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD
-
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-
-def _first_label(labels: List[str]) -> str:
-    return labels[0] if labels else "Node"
-
-def _node_label(props: Dict, labels: List[str]) -> str:
-    # Prefer a human title if present, else first label or id
-    for k in ("title", "name", "id"):
-        if k in props and isinstance(props[k], (str, int, float)):
-            return str(props[k])
-    return _first_label(labels)
-
-def _tooltip(props: Dict, labels: List[str]) -> str:
-    # Pretty JSON tooltip
-    return f"<b>{', '.join(labels) or 'Node'}</b><br/><pre style='white-space:pre-wrap'>{json.dumps(props, indent=2)[:4000]}</pre>"
-
-def render_graph_html(max_nodes: int = 1000) -> str:
-    """
-    Returns a path to a temporary HTML file with the interactive graph.
-    Only the first `max_nodes` nodes (ordered by internal id) are included,
-    and relationships only between those nodes.
-    """
-    with driver.session() as s:
-        # 1) Pick a node set (cap to avoid OOM on big graphs)
-        node_rows = s.run(
-            "MATCH (n) RETURN id(n) AS id, labels(n) AS labels, properties(n) AS props ORDER BY id(n) LIMIT $limit",
-            limit=max_nodes,
-        ).data()
-        node_ids = [r["id"] for r in node_rows] or [-1]
-
-        # 2) Relationships among those nodes
-        rel_rows = s.run(
-            """
-            MATCH (n)-[r]->(m)
-            WHERE id(n) IN $ids AND id(m) IN $ids
-            RETURN id(r) AS id, id(n) AS src, id(m) AS dst, type(r) AS type, properties(r) AS props
-            """,
-            ids=node_ids,
-        ).data()
-
-    net = Network(height="780px", width="100%", directed=True, bgcolor="#ffffff")
-    net.force_atlas_2based(gravity=-30)
-
-    # Add nodes
-    for r in node_rows:
-        nid = r["id"]
-        labels = r["labels"] or []
-        props = r["props"] or {}
-        net.add_node(
-            nid,
-            label=_node_label(props, labels),
-            title=_tooltip(props, labels),
-            shape="dot",
-            size=12,
-        )
-
-    # Add edges
-    for r in rel_rows:
-        net.add_edge(
-            r["src"],
-            r["dst"],
-            label=r["type"],
-            title=f"<b>{r['type']}</b><br/><pre style='white-space:pre-wrap'>{json.dumps(r.get('props', {}), indent=2)[:2000]}</pre>",
-            arrows="to",
-            physics=True,
-        )
-
-    # --- FIX: set_options must be JSON, not JS ---
-    net.set_options("""
-    {
-      "nodes": { "font": { "size": 12 } },
-      "edges": { "smooth": { "type": "dynamic" } },
-      "physics": {
-        "solver": "forceAtlas2Based",
-        "stabilization": { "iterations": 200 }
-      }
-    }
-    """)
-
-    # Write tmp HTML and return path
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".html")
-    tmp.close()
-    # Streamlit-safe render (no notebook template, no browser popup)
-    net.write_html(tmp.name, open_browser=False, notebook=False)
-    return tmp.name
-
-
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+import html, threading
+from pyvis.network import Network
+from .store import fetch, index_version
+
+SNIPPET_CHARS = 160   # chunk text shown in tooltips; full text / embeddings never leave the DB
+EXPAND_LIMIT = 200    # max chunks pulled for one expanded case study
+CACHE_SIZE = 64       # rendered pages, page rows and counts kept per process
+RELATED_LIMIT = 50    # non-chunk neighbors (company, program, tags, ...) drawn per case study
+LABEL_COLORS = {"Company": "#2ca02c", "County": "#9467bd", "GrantProgram": "#8c564b",
+                "TagTech": "#d62728", "TagOutcome": "#e377c2"}
+
+# One page of CaseStudy neighborhoods. Only lightweight, projected properties
+# are returned and edges come straight from the pattern (no id-IN scans).
+# Non-chunk neighbors come with their own non-chunk neighbors (a company's county);
+# chunks are the capped, expandable part.
+PAGE_CASES = """
+MATCH (cs:CaseStudy)
+WITH cs ORDER BY cs.case_id SKIP $skip LIMIT $limit
+CALL {
+  WITH cs
+  MATCH (cs)-[:HAS_CHUNK]->(c:Chunk)
+  WITH c ORDER BY c.order LIMIT $per_case
+  RETURN collect({chunk_id: c.chunk_id, order: c.order, start: c.char_start,
+                  end: c.char_end, snippet: left(c.text, $snip)}) AS chunks
+}
+CALL {
+  WITH cs
+  MATCH (cs)-[r]-(n) WHERE NOT n:Chunk AND NOT n:CaseStudy
+  WITH cs, r, n LIMIT $related
+  RETURN collect({id: elementId(n), label: head(labels(n)), name: coalesce(n.name, n.title),
+                  rel: type(r), out: startNode(r) = cs,
+                  via: [(n)-[r2]-(m) WHERE NOT m:Chunk AND NOT m:CaseStudy |
+                        {id: elementId(m), label: head(labels(m)), name: coalesce(m.name, m.title),
+                         rel: type(r2), out: startNode(r2) = n}]}) AS related
+}
+RETURN cs.case_id AS case_id, cs.title AS title, cs.url AS url,
+       COUNT { (cs)-[:HAS_CHUNK]->(:Chunk) } AS total, chunks, related
+"""
+
+# Expand-on-click: the remaining chunks of the selected case studies, in one round trip.
+EXPAND_CASES = """
+UNWIND $case_ids AS case_id
+MATCH (cs:CaseStudy {case_id: case_id})
+CALL {
+  WITH cs
+  MATCH (cs)-[:HAS_CHUNK]->(c:Chunk)
+  WITH c ORDER BY c.order SKIP $skip LIMIT $limit
+  RETURN collect({chunk_id: c.chunk_id, order: c.order, start: c.char_start,
+                  end: c.char_end, snippet: left(c.text, $snip)}) AS chunks
+}
+RETURN cs.case_id AS case_id, chunks
+"""
+
+COUNT_CASES = "MATCH (cs:CaseStudy) RETURN count(cs) AS n"
+
+_cache: "OrderedDict[Tuple, str]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _case_tooltip(r: Dict) -> str:
+    url = f"<br/>{html.escape(r['url'])}" if r.get("url") else ""
+    return f"<b>CaseStudy</b><br/>{html.escape(str(r['title']))}<br/>{r['total']} chunks{url}"
+
+def _chunk_tooltip(c: Dict) -> str:
+    return (
+        f"<b>Chunk</b> {html.escape(str(c['chunk_id']))}<br/>"
+        f"range={c['start']}-{c['end']}<br/>"
+        f"<pre style='white-space:pre-wrap'>{html.escape(c['snippet'] or '')}…</pre>"
+    )
+
+def _related_tooltip(n: Dict) -> str:
+    return f"<b>{html.escape(str(n['label']))}</b><br/>{html.escape(str(n['name'] or ''))}"
+
+def _add_related(net: Network, seen: set, node: str, n: Dict):
+    # Shared nodes (a county, a tag) and their edges are drawn once per page
+    other = f"n:{n['id']}"
+    if other not in seen:
+        seen.add(other)
+        net.add_node(other, label=str(n["name"] or n["label"]), title=_related_tooltip(n),
+                     shape="dot", size=12, color=LABEL_COLORS.get(n["label"], "#7f7f7f"))
+    edge = (node, other, n["rel"]) if n["out"] else (other, node, n["rel"])
+    if edge not in seen:
+        seen.add(edge)
+        net.add_edge(edge[0], edge[1], label=n["rel"], arrows="to", physics=True)
+
+def _cached(key: Tuple, compute: Callable[[], Any]) -> Any:
+    # Per-process LRU keyed by the index version, so the next ingestion invalidates everything
+    key = (index_version(),) + key
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    out = compute()
+    with _cache_lock:
+        _cache[key] = out
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return out
+
+def count_case_studies() -> int:
+    return _cached(("count",), lambda: int(fetch(COUNT_CASES)[0]["n"]))
+
+def fetch_page(page: int = 0, cases_per_page: int = 25, chunks_per_case: int = 5) -> List[Dict]:
+    return _cached(("page", page, cases_per_page, chunks_per_case), lambda: fetch(
+        PAGE_CASES,
+        skip=page * cases_per_page,
+        limit=cases_per_page,
+        per_case=chunks_per_case,
+        related=RELATED_LIMIT,
+        snip=SNIPPET_CHARS,
+    ))
+
+def fetch_expanded(case_ids: Sequence[str], skip: int = 0, limit: int = EXPAND_LIMIT) -> Dict[str, List[Dict]]:
+    if not case_ids:
+        return {}
+    rows = fetch(EXPAND_CASES, case_ids=list(case_ids), skip=skip, limit=limit, snip=SNIPPET_CHARS)
+    return {r["case_id"]: r["chunks"] for r in rows}
+
+def _build_html(rows: List[Dict], expanded: Dict[str, List[Dict]]) -> str:
+    net = Network(height="780px", width="100%", directed=True, bgcolor="#ffffff", cdn_resources="remote")
+    net.force_atlas_2based(gravity=-30)
+
+    seen: set = set()
+    for r in rows:
+        case_node = f"cs:{r['case_id']}"
+        net.add_node(case_node, label=str(r["title"]), title=_case_tooltip(r),
+                     shape="dot", size=20, color="#1f77b4")
+        for n in r.get("related", []):
+            _add_related(net, seen, case_node, n)
+            for m in n["via"]:
+                _add_related(net, seen, f"n:{n['id']}", m)
+        chunks = {c["chunk_id"]: c for c in r["chunks"]}
+        chunks.update({c["chunk_id"]: c for c in expanded.get(r["case_id"], [])})
+        for c in sorted(chunks.values(), key=lambda c: c["order"]):
+            chunk_node = f"ch:{c['chunk_id']}"
+            net.add_node(chunk_node, label=f"#{c['order']}", title=_chunk_tooltip(c),
+                         shape="dot", size=8, color="#ff7f0e")
+            net.add_edge(case_node, chunk_node, label="HAS_CHUNK", arrows="to", physics=True)
+
+    # --- FIX: set_options must be JSON, not JS ---
+    net.set_options("""
+    {
+      "nodes": { "font": { "size": 12 } },
+      "edges": { "smooth": { "type": "dynamic" } },
+      "physics": {
+        "solver": "forceAtlas2Based",
+        "stabilization": { "iterations": 200 }
+      }
+    }
+    """)
+    # Rendered in memory: nothing is written to disk, so there is nothing to clean up.
+    return net.generate_html(notebook=False)
+
+def render_graph_html(
+    page: int = 0,
+    cases_per_page: int = 25,
+    chunks_per_case: int = 5,
+    expanded: Sequence[str] = (),
+) -> str:
+    """
+    Returns the interactive graph HTML for one page of CaseStudy neighborhoods.
+    Each case study shows up to `chunks_per_case` chunks; case ids listed in
+    `expanded` additionally pull up to EXPAND_LIMIT of their chunks.
+    Results are cached per process until the next ingestion bumps the index version.
+    """
+    def build() -> str:
+        rows = fetch_page(page, cases_per_page, chunks_per_case)
+        on_page = {r["case_id"] for r in rows}
+        # The first chunks_per_case chunks are already on the page; expanding loads the rest
+        return _build_html(rows, fetch_expanded([c for c in expanded if c in on_page], skip=chunks_per_case))
+
+    return _cached(("html", page, cases_per_page, chunks_per_case, tuple(sorted(expanded))), build)
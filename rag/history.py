@@ -0,0 +1,62 @@
+from collections import deque
+from itertools import islice
+from typing import Dict, List, Optional
+from config import HISTORY_MAX_TURNS
+from .models import SourceRef
+from .store import get_context
+
+SNIPPET_CHARS = 220
+
+def source_refs(top: List[Dict], n: int = 3) -> List[SourceRef]:
+    return [
+        SourceRef(
+            chunk_id=c['cid'],
+            case_id=c['case_id'],
+            title=c['title'],
+            url=c['url'],
+            snippet=c['text'][:SNIPPET_CHARS] + ('…' if len(c['text']) > SNIPPET_CHARS else ''),
+            score=round(float(c['hybrid']), 3),
+            char_start=int(c['start']),
+            char_end=int(c['end']),
+        )
+        for c in (top or [])[:n]
+    ]
+
+def full_text(chunk_id: str) -> Optional[str]:
+    rec = get_context(chunk_id)
+    return rec['text'] if rec else None
+
+class ChatHistory:
+    """
+    Bounded chat history for one session. Turns keep SourceRefs (chunk id plus
+    a snippet) instead of full chunk text; the oldest turns fall off once
+    `max_turns` is reached.
+    """
+
+    def __init__(self, max_turns: int = HISTORY_MAX_TURNS):
+        self.turns: deque = deque(maxlen=max_turns)
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def append(self, question: str, answer: str, grounded: bool,
+               external_link: Optional[str], sources: List[SourceRef]) -> Dict:
+        turn = {
+            "id": self._next_id,
+            "q": question,
+            "resp": {
+                "answer": answer,
+                "sources": [s.model_dump() for s in sources],
+                "grounded_in_db": grounded,
+                "external_link": external_link,
+            },
+        }
+        self._next_id += 1
+        self.turns.append(turn)
+        return turn
+
+    def latest(self, n: int) -> List[Dict]:
+        # Last n turns, oldest first, without copying the whole deque
+        n = min(n, len(self.turns))
+        return list(islice(reversed(self.turns), n))[::-1]
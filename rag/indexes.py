@@ -0,0 +1,300 @@
+"""
+Index maintenance and corpus statistics.
+
+    python -m rag.indexes check              # ensure, wait until ONLINE, validate
+    python -m rag.indexes stats              # corpus statistics
+    python -m rag.indexes rebuild vector     # zero-downtime rebuild (or: fulltext)
+
+Neo4j keeps one index per label and property, so a rebuild indexes the same
+property under a fresh label. The label is first registered on the Meta node as
+pending, so every process's writes add it; then existing chunks are labelled in
+batches and the index is created under a new name. Once it is ONLINE the active
+name and label are swapped on the Meta node. Searches read them with the index
+version, so every process moves over within INDEX_VERSION_TTL_S; after a grace
+period the old index is dropped and its label removed.
+Chunks written outside aupsert_chunks (the Neo4J/ notebook) get the active
+labels from aensure_indexes; avalidate reports any that lack them.
+"""
+import argparse, asyncio, json, time
+from typing import Callable, Dict, List, Optional
+from config import EMBED_DIM, INDEX_VERSION_TTL_S
+from .aio import run
+from .store import (afetch, aensure_indexes, set_index_meta, active_labels, CREATE_FTS, CREATE_VEC, CREATE_META,
+                    FTS_INDEX, VEC_INDEX, GET_INDEX_VERSION, LABEL_CHUNKS)
+
+SHOW_INDEXES = """
+SHOW INDEXES YIELD name, type, labelsOrTypes, properties, state, populationPercent, options
+"""
+
+RANGE_INDEXES = [q.split()[2] for q in CREATE_META]
+
+# Distinct embedding sizes among a sample of chunks; a mismatch with the index means silent misses
+SAMPLE_EMBED_DIMS = """
+MATCH (c:Chunk) WHERE c.embedding IS NOT NULL
+WITH c LIMIT 200
+RETURN DISTINCT size(c.embedding) AS dim
+"""
+
+# Rebuild labels: <prefix>_<timestamp>, next to the Chunk label the first indexes use
+REBUILD_LABELS = {"vector": "ChunkVec", "fulltext": "ChunkFts"}
+
+ADD_PENDING_LABEL = """
+MERGE (m:Meta {key: 'index'})
+SET m.pending_labels = coalesce(m.pending_labels, []) + $label
+RETURN m.pending_labels AS pending_labels
+"""
+
+DROP_PENDING_LABEL = """
+MATCH (m:Meta {key: 'index'})
+SET m.pending_labels = [l IN coalesce(m.pending_labels, []) WHERE l <> $label]
+"""
+
+UNLABEL_CHUNKS = """
+MATCH (c:{label})
+CALL {
+  WITH c
+  REMOVE c:{label}
+} IN TRANSACTIONS OF 10000 ROWS
+"""
+
+UNLABELLED_CHUNKS = "MATCH (c:Chunk) WHERE NOT c:{label} RETURN count(c) AS n"
+
+SWAP_INDEX = """
+MERGE (m:Meta {key: 'index'})
+SET m.{kind}_index = $name, m.{kind}_label = $label,
+    m.pending_labels = [l IN coalesce(m.pending_labels, []) WHERE l <> $label],
+    m.version = coalesce(m.version, 0) + 1
+RETURN m.version AS version, m.pending_labels AS pending_labels
+"""
+
+DROP_INDEX = "DROP INDEX {name} IF EXISTS"
+
+async def _aindex_rows() -> Dict[str, Dict]:
+    return {r["name"]: r for r in await afetch(SHOW_INDEXES)}
+
+async def _aactive() -> Dict:
+    # Fresh read, bypassing the TTL memo in store
+    return (await afetch(GET_INDEX_VERSION))[0]
+
+async def aawait_indexes(
+    names: Optional[List[str]] = None,
+    timeout: float = 600,
+    poll: float = 1.0,
+    on_progress: Optional[Callable[[List[Dict]], None]] = None,
+) -> List[Dict]:
+    """
+    Polls until the named indexes (default: all) are ONLINE. Raises on a
+    FAILED or missing index, or after `timeout` seconds. `on_progress` gets
+    the index rows on every poll (it runs on the I/O loop thread).
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        rows = await _aindex_rows()
+        missing = [n for n in names or [] if n not in rows]
+        if missing:
+            raise LookupError(f"index(es) not found: {', '.join(missing)}")
+        rows = [r for name, r in rows.items() if names is None or name in names]
+        failed = [r["name"] for r in rows if r["state"] == "FAILED"]
+        if failed:
+            raise RuntimeError(f"index(es) FAILED: {', '.join(failed)}; rebuild them")
+        if on_progress:
+            on_progress(rows)
+        pending = [r for r in rows if r["state"] != "ONLINE"]
+        if not pending:
+            return rows
+        if time.monotonic() > deadline:
+            states = ", ".join(f"{r['name']} {r['state']} {r['populationPercent'] or 0:.0f}%" for r in pending)
+            raise TimeoutError(f"indexes not ONLINE after {timeout:.0f}s: {states}")
+        await asyncio.sleep(poll)
+
+def _issue(level: str, index: str, message: str) -> Dict:
+    return {"level": level, "index": index, "message": message}
+
+async def avalidate(dim: int = EMBED_DIM) -> List[Dict]:
+    """
+    Checks that every index the app queries exists, is ONLINE and is
+    configured as searches expect. Returns a list of issues, empty when healthy.
+    """
+    rows = await _aindex_rows()
+    active = await _aactive()
+    fts, vec = active["fts"], active["vec"]
+    labels = {fts: active["fts_label"], vec: active["vec_label"]}
+    issues = []
+    for name in [fts, vec, *RANGE_INDEXES]:
+        r = rows.get(name)
+        if r is None:
+            issues.append(_issue("error", name, "missing; run Ensure Indexes"))
+        elif r["state"] == "FAILED":
+            issues.append(_issue("error", name, "FAILED; rebuild it"))
+        elif r["state"] != "ONLINE":
+            issues.append(_issue("warning", name, f"{r['state']} ({r['populationPercent'] or 0:.0f}%), results may be incomplete"))
+
+    r = rows.get(vec)
+    if r is not None:
+        cfg = (r.get("options") or {}).get("indexConfig") or {}
+        if r["type"] != "VECTOR" or r["labelsOrTypes"] != [labels[vec]] or r["properties"] != ["embedding"]:
+            issues.append(_issue("error", vec, f"is a {r['type']} index on {r['labelsOrTypes']} {r['properties']}, "
+                                               f"expected VECTOR on {labels[vec]} embedding"))
+        if cfg.get("vector.dimensions") != dim:
+            issues.append(_issue("error", vec, f"has {cfg.get('vector.dimensions')} dimensions but EMBED_DIM is {dim}; "
+                                               "vector search returns nothing, rebuild it"))
+        if cfg.get("vector.similarity_function", "").lower() != "cosine":
+            issues.append(_issue("warning", vec, f"uses {cfg.get('vector.similarity_function')} similarity, expected cosine"))
+    r = rows.get(fts)
+    if r is not None and (r["type"] != "FULLTEXT" or r["labelsOrTypes"] != [labels[fts]] or r["properties"] != ["text"]):
+        issues.append(_issue("error", fts, f"is a {r['type']} index on {r['labelsOrTypes']} {r['properties']}, "
+                                           f"expected FULLTEXT on {labels[fts]} text"))
+
+    for label in active_labels(active):
+        n = (await afetch(UNLABELLED_CHUNKS.replace("{label}", label)))[0]["n"]
+        if n:
+            issues.append(_issue("error", label, f"{n} chunk(s) lack this label, so the search index skips them; "
+                                                 "run Ensure Indexes"))
+
+    dims = sorted(row["dim"] for row in await afetch(SAMPLE_EMBED_DIMS))
+    if any(d != dim for d in dims):
+        issues.append(_issue("error", "Chunk.embedding", f"stored embeddings have {dims} dimensions but EMBED_DIM is {dim}; "
+                                                         "those chunks are invisible to vector search, re-ingest them"))
+    return issues
+
+async def aensure(dim: int = EMBED_DIM, timeout: float = 600) -> List[Dict]:
+    # Create what is missing, wait for population, then validate
+    await aensure_indexes(dim)
+    active = await _aactive()
+    await aawait_indexes([active["fts"], active["vec"], *RANGE_INDEXES], timeout=timeout)
+    return await avalidate(dim)
+
+async def arebuild(
+    kind: str,
+    dim: int = EMBED_DIM,
+    timeout: float = 3600,
+    grace: Optional[float] = None,
+    on_progress: Optional[Callable[[List[Dict]], None]] = None,
+) -> str:
+    """
+    Zero-downtime rebuild of the "vector" or "fulltext" index. Searches keep
+    using the old index until the new one is ONLINE; returns the new name.
+    `grace` (default: two Meta reads) is waited twice: for writers to start
+    adding the new label, and for searches to leave the old index.
+    """
+    if kind not in ("vector", "fulltext"):
+        raise ValueError(f"kind must be 'vector' or 'fulltext', not {kind!r}")
+    prefix, base, create = (("vec", VEC_INDEX, CREATE_VEC) if kind == "vector"
+                            else ("fts", FTS_INDEX, CREATE_FTS))
+    active = await _aactive()
+    old, old_label = active[prefix], active[f"{prefix}_label"]
+    stamp = int(time.time())
+    new, label = f"{base}_{stamp}", f"{REBUILD_LABELS[kind]}_{stamp}"
+    settle = 2 * INDEX_VERSION_TTL_S + 5 if grace is None else grace
+
+    # Every process picks up the pending label on its next Meta read; chunks written after that carry it
+    pending = (await afetch(ADD_PENDING_LABEL, label=label))[0]["pending_labels"]
+    set_index_meta(pending_labels=list(pending))
+    await asyncio.sleep(settle)
+    try:
+        await afetch(LABEL_CHUNKS.replace("{label}", label))
+        await afetch(create.replace("{name}", new).replace("{label}", label), dim=dim)
+        await aawait_indexes([new], timeout=timeout, on_progress=on_progress)
+    except Exception:
+        await afetch(DROP_INDEX.replace("{name}", new))
+        await afetch(UNLABEL_CHUNKS.replace("{label}", label))
+        await afetch(DROP_PENDING_LABEL, label=label)
+        raise
+    row = (await afetch(SWAP_INDEX.replace("{kind}", prefix), name=new, label=label))[0]
+    set_index_meta(value=int(row["version"]), pending_labels=list(row["pending_labels"]),
+                   **{prefix: new, f"{prefix}_label": label})
+    # Let in-flight searches and stale Meta reads finish with the old index
+    await asyncio.sleep(settle)
+    await afetch(DROP_INDEX.replace("{name}", old))
+    if old_label != "Chunk":
+        await afetch(UNLABEL_CHUNKS.replace("{label}", old_label))
+    return new
+
+# --- Corpus statistics ---
+CHUNK_STATS = """
+MATCH (c:Chunk)
+RETURN count(c) AS chunks, count(c.embedding) AS embedded, count(c.dup_of) AS linked_duplicates,
+       avg(size(c.text)) AS avg_chars, min(size(c.text)) AS min_chars, max(size(c.text)) AS max_chars
+"""
+
+CASE_STATS = """
+MATCH (cs:CaseStudy)
+RETURN count(cs) AS case_studies,
+       count(CASE WHEN NOT (cs)-[:HAS_CHUNK]->(:Chunk) THEN 1 END) AS empty_case_studies
+"""
+
+EMBED_DIMS = """
+MATCH (c:Chunk) WHERE c.embedding IS NOT NULL
+RETURN size(c.embedding) AS dim, count(*) AS chunks
+ORDER BY chunks DESC
+"""
+
+ORPHAN_CHUNKS = """
+MATCH (c:Chunk) WHERE NOT (:CaseStudy)-[:HAS_CHUNK]->(c)
+RETURN count(c) AS orphan_chunks, collect(c.chunk_id)[..10] AS examples
+"""
+
+# Exact repeats not linked by ingest-time dedup (older uploads, or dedup turned off)
+DUPLICATE_TEXT = """
+MATCH (c:Chunk) WHERE c.dup_of IS NULL
+WITH c.text AS text, collect(c.chunk_id) AS ids
+WHERE size(ids) > 1
+RETURN count(*) AS groups, coalesce(sum(size(ids) - 1), 0) AS redundant_chunks,
+       collect(ids[..3])[..10] AS examples
+"""
+
+async def acorpus_stats() -> Dict:
+    # Full scans; meant for the admin panel and the CLI, not per request
+    chunks, cases, dims, orphans, dups = await asyncio.gather(
+        afetch(CHUNK_STATS), afetch(CASE_STATS), afetch(EMBED_DIMS), afetch(ORPHAN_CHUNKS), afetch(DUPLICATE_TEXT))
+    return {
+        **chunks[0],
+        **cases[0],
+        "embedding_dims": {r["dim"]: r["chunks"] for r in dims},
+        "orphan_chunks": orphans[0]["orphan_chunks"],
+        "orphan_examples": orphans[0]["examples"],
+        "duplicate_groups": dups[0]["groups"],
+        "duplicate_chunks": dups[0]["redundant_chunks"],
+        "duplicate_examples": dups[0]["examples"],
+    }
+
+def await_indexes(names: Optional[List[str]] = None, timeout: float = 600) -> List[Dict]:
+    return run(aawait_indexes(names, timeout))
+
+def validate(dim: int = EMBED_DIM) -> List[Dict]:
+    return run(avalidate(dim))
+
+def ensure(dim: int = EMBED_DIM, timeout: float = 600) -> List[Dict]:
+    return run(aensure(dim, timeout))
+
+def rebuild(kind: str, dim: int = EMBED_DIM, timeout: float = 3600, grace: Optional[float] = None) -> str:
+    return run(arebuild(kind, dim, timeout, grace))
+
+def index_rows() -> List[Dict]:
+    return list(run(_aindex_rows()).values())
+
+def corpus_stats() -> Dict:
+    return run(acorpus_stats())
+
+def _print_progress(rows: List[Dict]):
+    print("  " + ", ".join(f"{r['name']} {r['state']} {r['populationPercent'] or 0:.0f}%" for r in rows), flush=True)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Index maintenance and corpus statistics.")
+    ap.add_argument("command", choices=["check", "stats", "rebuild"])
+    ap.add_argument("kind", nargs="?", choices=["vector", "fulltext"], help="index to rebuild")
+    ap.add_argument("--timeout", type=float, default=3600)
+    args = ap.parse_args()
+    if args.command == "check":
+        issues = ensure(timeout=args.timeout)
+        for i in issues:
+            print(f"{i['level'].upper():8}{i['index']}: {i['message']}")
+        print("indexes healthy" if not issues else f"{len(issues)} issue(s)")
+        raise SystemExit(1 if any(i["level"] == "error" for i in issues) else 0)
+    if args.command == "stats":
+        print(json.dumps(corpus_stats(), indent=2, default=str))
+    else:
+        if args.kind is None:
+            ap.error("rebuild needs an index kind: vector or fulltext")
+        name = run(arebuild(args.kind, timeout=args.timeout, on_progress=_print_progress))
+        print(f"{args.kind} index rebuilt as {name}")
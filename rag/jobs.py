@@ -0,0 +1,192 @@
+import json, sqlite3, time, uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from config import JOBS_DB
+
+# Persistent ingestion queue. Uploads are enqueued by the app and drained by
+# the worker (python -m rag.worker); done_chunks is the resume checkpoint.
+# claim() hands each run a fresh owner token and every later update checks it,
+# so a worker whose job was taken over as stale can no longer write to it.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued | running | done | failed
+    filename TEXT NOT NULL,
+    kind TEXT NOT NULL,                     -- pdf | md
+    data BLOB,                              -- raw upload, dropped once the job is done
+    meta TEXT NOT NULL,                     -- JSON: case_id, title, url, industry, year, tags
+    text TEXT,                              -- extracted text, so a resume skips parsing; dropped when done
+    report TEXT,                            -- JSON: extraction notes shown in the admin panel
+    total_chunks INTEGER,
+    done_chunks INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat REAL,
+    owner TEXT                              -- lease token of the run holding the job
+);
+CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs(status, id);
+CREATE TABLE IF NOT EXISTS batches (
+    job_id INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS batches_time_idx ON batches(finished_at);
+"""
+
+class LeaseLost(RuntimeError):
+    """The job was claimed by another worker after this one stopped heartbeating."""
+
+def _migrate(con: sqlite3.Connection):
+    # Queues created before owner tokens
+    if "owner" not in {r["name"] for r in con.execute("PRAGMA table_info(jobs)")}:
+        try:
+            con.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        except sqlite3.OperationalError as e:
+            if "duplicate column" not in str(e):
+                raise
+
+STATS_WINDOW = 3600   # seconds of batch history kept for throughput
+
+def connect(path: str = JOBS_DB) -> sqlite3.Connection:
+    # Short-lived connections: safe to use from the app, the worker and the I/O loop thread
+    con = sqlite3.connect(path, timeout=30, isolation_level=None)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL")
+    con.executescript(SCHEMA)
+    _migrate(con)
+    return con
+
+def _owned(cur: sqlite3.Cursor, job_id: int):
+    if cur.rowcount == 0:
+        raise LeaseLost(f"job {job_id} was taken over by another worker")
+
+@contextmanager
+def _db():
+    con = connect()
+    try:
+        yield con
+    finally:
+        con.close()
+
+def enqueue(filename: str, kind: str, data: bytes, meta: Dict) -> int:
+    with _db() as con:
+        cur = con.execute(
+            "INSERT INTO jobs (filename, kind, data, meta, created_at) VALUES (?, ?, ?, ?, ?)",
+            (filename, kind, data, json.dumps(meta), time.time()),
+        )
+        return int(cur.lastrowid)
+
+def claim(stale_after: float) -> Optional[Dict]:
+    """
+    Atomically takes the oldest queued job, or a running job whose worker
+    stopped heartbeating more than `stale_after` seconds ago. The job's
+    "owner" token must be passed to every later update.
+    """
+    now = time.time()
+    con = connect()
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        row = con.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?) "
+            "ORDER BY id LIMIT 1",
+            (now - stale_after,),
+        ).fetchone()
+        if row is None:
+            con.execute("COMMIT")
+            return None
+        owner = uuid.uuid4().hex
+        con.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, heartbeat = ?, owner = ?, "
+            "started_at = coalesce(started_at, ?) WHERE id = ?",
+            (now, owner, now, row["id"]),
+        )
+        con.execute("COMMIT")
+        job = dict(row)
+        job["meta"] = json.loads(job["meta"])
+        job["attempts"] += 1
+        job["owner"] = owner
+        return job
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+def save_text(job_id: int, owner: str, text: str, total_chunks: int, report: Dict):
+    with _db() as con:
+        _owned(con.execute(
+            "UPDATE jobs SET text = ?, total_chunks = ?, report = ?, heartbeat = ? WHERE id = ? AND owner = ?",
+            (text, total_chunks, json.dumps(report), time.time(), job_id, owner),
+        ), job_id)
+
+def heartbeat(job_id: int, owner: str):
+    # For long steps without batches (OCR); raises LeaseLost like checkpoint
+    with _db() as con:
+        _owned(con.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ?",
+                           (time.time(), job_id, owner)), job_id)
+
+def checkpoint(job_id: int, owner: str, done_chunks: int, n: int):
+    # Called only after the batch is committed to Neo4j; raises LeaseLost so the run stops
+    now = time.time()
+    with _db() as con:
+        # One transaction: progress and its throughput sample land together
+        con.execute("BEGIN")
+        try:
+            _owned(con.execute("UPDATE jobs SET done_chunks = ?, heartbeat = ? WHERE id = ? AND owner = ?",
+                               (done_chunks, now, job_id, owner)), job_id)
+            con.execute("INSERT INTO batches (job_id, n, finished_at) VALUES (?, ?, ?)", (job_id, n, now))
+            con.execute("DELETE FROM batches WHERE finished_at < ?", (now - STATS_WINDOW,))
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
+def finish(job_id: int, owner: str):
+    with _db() as con:
+        _owned(con.execute(
+            "UPDATE jobs SET status = 'done', data = NULL, text = NULL, error = NULL, owner = NULL, finished_at = ? "
+            "WHERE id = ? AND owner = ?",
+            (time.time(), job_id, owner),
+        ), job_id)
+
+def fail(job_id: int, owner: str, error: str, retry: bool) -> bool:
+    # False when the job already belongs to another worker; it is left to that one
+    with _db() as con:
+        cur = con.execute(
+            "UPDATE jobs SET status = ?, error = ?, owner = NULL, finished_at = ? WHERE id = ? AND owner = ?",
+            ("queued" if retry else "failed", error[:2000], None if retry else time.time(), job_id, owner),
+        )
+        return cur.rowcount > 0
+
+def queue_stats(window: float = STATS_WINDOW) -> Dict:
+    now = time.time()
+    with _db() as con:
+        counts = {r["status"]: r["n"] for r in con.execute("SELECT status, count(*) AS n FROM jobs GROUP BY status")}
+        chunks = con.execute(
+            "SELECT coalesce(sum(n), 0) AS n FROM batches WHERE finished_at >= ?", (now - window,)
+        ).fetchone()["n"]
+    return {
+        "queued": counts.get("queued", 0),
+        "running": counts.get("running", 0),
+        "done": counts.get("done", 0),
+        "failed": counts.get("failed", 0),
+        "chunks_per_min": chunks / (window / 60),
+    }
+
+def recent_jobs(limit: int = 20) -> List[Dict]:
+    with _db() as con:
+        rows = con.execute(
+            "SELECT id, status, filename, meta, report, total_chunks, done_chunks, attempts, error, "
+            "created_at, finished_at FROM jobs ORDER BY id DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+    out = []
+    for r in rows:
+        job = dict(r)
+        job["meta"] = json.loads(job["meta"])
+        job["report"] = json.loads(job["report"]) if job["report"] else {}
+        out.append(job)
+    return out
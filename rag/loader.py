@@ -1,10 +1,16 @@
+import asyncio, io
+from typing import Callable, Dict, List, Optional, Tuple
 import streamlit as st
 import fitz  # PyMuPDF
-from .store import upsert_chunk
-from .composer import embed_query
+from config import OCR_ENABLED, OCR_MIN_CHARS, DEDUP_ENABLED
+from .store import aupsert_chunks, aexisting_canonical
+from .composer import aembed_texts
+from .dedup import Deduper, dedup_stats
+from . import jobs, ocr
 
 CHARS = 1400
 OVERLAP = 200
+EMBED_BATCH = 64        # chunks per embeddings request / UNWIND write
 
 def _chunks(text: str):
     i = 0; n = len(text)
@@ -13,20 +19,103 @@ def _chunks(text: str):
         yield text[i:j], i, j
         i += CHARS - OVERLAP if i+CHARS < n else j
 
-def _read_pdf(file) -> str:
+def _read_pdf(file, on_page: Optional[Callable[[], None]] = None) -> Tuple[str, Dict]:
     doc = fitz.open(stream=file.read(), filetype="pdf")
-    out = []
-    for p in doc:
-        out.append(p.get_text())
-    return "\n".join(out)
+    out = [p.get_text() for p in doc]
+    report = {"pages": len(out)}
+    # Scanned pages have no text layer; OCR those (in parallel, cached by page hash)
+    blank = [i for i, t in enumerate(out) if len(t.strip()) < OCR_MIN_CHARS]
+    if blank and OCR_ENABLED:
+        texts, ocr_report = ocr.ocr_pages(doc, blank, on_page)
+        for i, t in texts.items():
+            out[i] = t
+        report.update(ocr_report)
+    elif blank:
+        report["blank_pages"] = [i + 1 for i in blank]
+    return "\n".join(out), report
 
 def _read_md(file) -> str:
     return file.read().decode("utf-8")
 
-@st.cache_data(show_spinner=False)
-def _embed(text: str):
-    # Reuse query embedding for MVP
-    return embed_query(text)
+def extract_text(data: bytes, kind: str, on_page: Optional[Callable[[], None]] = None) -> Tuple[str, Dict]:
+    # Returns the document text and a small report for the admin panel; on_page ticks during OCR
+    if kind == "pdf":
+        return _read_pdf(io.BytesIO(data), on_page)
+    return _read_md(io.BytesIO(data)), {}
+
+def chunk_records(text: str, meta: Dict) -> List[dict]:
+    # Chunk records without embeddings; deterministic, so a resumed job rebuilds the same list
+    recs = []
+    for order, (chunk, s, e) in enumerate(_chunks(text)):
+        recs.append({
+            **meta,
+            "chunk_id": f"{meta['case_id']}-{order:04d}",
+            "text": chunk,
+            "order": int(order),
+            "start": int(s),
+            "end": int(e),
+        })
+    return recs
+
+async def _amark_duplicates(recs: List[dict], deduper: Deduper):
+    # JOBS_DB can name chunks Neo4j no longer has; those are forgotten and their matches re-marked
+    deduper.mark(recs)
+    while True:
+        stored = deduper.stored_matches(recs)
+        missing = set(stored) - await aexisting_canonical(stored) if stored else set()
+        if not missing:
+            return
+        deduper.forget(sorted(missing))
+        deduper.mark([r for r in recs if r.get("dup_of") in missing])
+
+async def _aembed_batch(recs: List[dict], deduper: Optional[Deduper]) -> List[Optional[List[float]]]:
+    # Near-duplicates are linked to their canonical chunk instead of being embedded
+    if deduper is not None:
+        await _amark_duplicates(recs, deduper)
+    todo = [r["text"] for r in recs if not r.get("dup_of")]
+    vecs = iter(await aembed_texts(todo) if todo else [])
+    return [None if r.get("dup_of") else next(vecs) for r in recs]
+
+async def aingest_records(
+    recs: List[dict],
+    start: int = 0,
+    on_batch: Optional[Callable[[int, int], None]] = None,
+    batch: int = EMBED_BATCH,
+    dedup: bool = DEDUP_ENABLED,
+):
+    """
+    Embeds and writes `recs[start:]` in batches. The next batch is embedded
+    while the current one is written; `on_batch(done, n)` runs after each
+    write has committed, in order, so it can serve as a resume checkpoint.
+    """
+    # Chunk texts bypass the shared query-embedding cache
+    batches = [recs[i:i + batch] for i in range(start, len(recs), batch)]
+    if not batches:
+        return
+    deduper = Deduper() if dedup else None
+    done = start
+    nxt = asyncio.ensure_future(_aembed_batch(batches[0], deduper))
+    try:
+        for i, b in enumerate(batches):
+            vecs = await nxt
+            if i + 1 < len(batches):
+                nxt = asyncio.ensure_future(_aembed_batch(batches[i + 1], deduper))
+            await aupsert_chunks([{**r, "embedding": v} for r, v in zip(b, vecs)])
+            if deduper is not None:
+                deduper.commit(b)
+            done += len(b)
+            if on_batch:
+                on_batch(done, len(b))
+    finally:
+        nxt.cancel()  # no-op once awaited; drops a prefetch if a write failed
+
+def _metadata(industry: str, year: int, tags: str) -> dict:
+    # Stored lower-cased so scoped searches can match on exact values
+    return {
+        "industry": industry.strip().lower() or None,
+        "year": int(year) or None,
+        "tags": sorted({t.strip().lower() for t in tags.split(",") if t.strip()}),
+    }
 
 def upload_and_ingest():
     files = st.file_uploader("Upload PDF or Markdown", type=["pdf","md"], accept_multiple_files=True)
@@ -35,23 +124,45 @@ def upload_and_ingest():
     title = st.text_input("Case Study Title", value="Untitled Case Study")
     url = st.text_input("Source URL (optional)")
     case_id = st.text_input("Case ID", value=title.lower().replace(" ", "-"))
+    industry = st.text_input("Industry (optional)")
+    year = st.number_input("Year (optional, 0 = unknown)", min_value=0, max_value=2100, value=0, step=1)
+    tags = st.text_input("Tags (optional, comma-separated)")
+    meta = _metadata(industry, year, tags)
     if st.button("Ingest"):
+        # Parsing, embedding and writing happen in the worker process, not in this script run
         for f in files:
-            text = _read_pdf(f) if f.type == 'application/pdf' else _read_md(f)
-            order = 0
-            for chunk, s, e in _chunks(text):
-                cid = f"{case_id}-{order:04d}"
-                vec = _embed(chunk)
-                upsert_chunk({
-                    "case_id": case_id,
-                    "title": title,
-                    "url": url,
-                    "chunk_id": cid,
-                    "text": chunk,
-                    "order": int(order),
-                    "start": int(s),
-                    "end": int(e),
-                    "embedding": vec
-                })
-                order += 1
-        st.success("Ingestion complete.")
+            kind = "pdf" if f.type == 'application/pdf' else "md"
+            jobs.enqueue(f.name, kind, f.getvalue(), {"case_id": case_id, "title": title, "url": url, **meta})
+        st.success(f"Queued {len(files)} file(s) for ingestion. Progress is shown under Ingestion queue.")
+
+def _report_note(report: Dict) -> str:
+    notes = []
+    if report.get("ocr_pages"):
+        notes.append(f"OCR: {len(report['ocr_pages'])}/{report['pages']} pages ({report['ocr_cached']} cached)")
+    if report.get("ocr_failed"):
+        notes.append(f"OCR failed on pages {_page_list(report['ocr_failed'])}: {report.get('ocr_error', '')[:80]}")
+    if report.get("blank_pages"):
+        notes.append(f"no text on pages {_page_list(report['blank_pages'])} (OCR off)")
+    return "".join(f" — {n}" for n in notes)
+
+def _page_list(pages: List[int], n: int = 8) -> str:
+    return ", ".join(map(str, pages[:n])) + (f" … (+{len(pages) - n})" if len(pages) > n else "")
+
+def ingest_queue_panel():
+    stats = jobs.queue_stats()
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Queued", stats["queued"])
+    c2.metric("Running", stats["running"])
+    c3.metric("Chunks/min (1h)", f"{stats['chunks_per_min']:.0f}")
+    if stats["failed"]:
+        st.warning(f"{stats['failed']} job(s) failed.")
+    if DEDUP_ENABLED:
+        d = dedup_stats()
+        st.caption(f"Near-duplicates linked instead of embedded: {d['duplicates']} chunk(s) "
+                   f"in {d['clusters']} cluster(s); {d['canonical']} unique chunk(s) indexed.")
+    for j in jobs.recent_jobs(10):
+        total = j["total_chunks"]
+        progress = f"{j['done_chunks']}/{total}" if total is not None else "pending"
+        st.caption(f"#{j['id']} {j['filename']} → {j['meta']['case_id']}: {j['status']} ({progress})"
+                   + _report_note(j["report"])
+                   + (f" — {j['error'][:120]}" if j["error"] else ""))
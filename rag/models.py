@@ -12,6 +12,22 @@ class CaseStudy(BaseModel):
     case_id: str
     title: str
     url: Optional[str] = None
+    industry: Optional[str] = None
+    year: Optional[int] = None
+    tags: List[str] = []
+
+class SearchFilters(BaseModel):
+    # Empty fields mean "no restriction"; values are matched against the
+    # normalized (lower-cased) metadata stored on CaseStudy and Chunk.
+    case_ids: List[str] = []
+    industries: List[str] = []
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    tags: List[str] = []
+
+    def is_empty(self) -> bool:
+        return not (self.case_ids or self.industries or self.tags
+                    or self.year_from is not None or self.year_to is not None)
 
 class AnswerItem(BaseModel):
     answer_snippet: str
@@ -19,6 +35,17 @@ class AnswerItem(BaseModel):
     case_study: CaseStudy
     chunk: Chunk
 
+class SourceRef(BaseModel):
+    # Compact pointer to a source chunk kept in chat history; full text is fetched on demand
+    chunk_id: str
+    case_id: str
+    title: str
+    url: Optional[str] = None
+    snippet: str
+    score: float
+    char_start: int
+    char_end: int
+
 class QAResponse(BaseModel):
     answer: str
     top3: List[AnswerItem]
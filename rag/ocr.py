@@ -0,0 +1,111 @@
+import hashlib, os, tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Optional, Tuple
+import fitz  # PyMuPDF
+from config import OCR_WORKERS, OCR_DPI, OCR_LANG, OCR_CACHE_DIR
+
+# OCR fallback for scanned PDF pages: Tesseract through PyMuPDF, one page per
+# task in a process pool, results cached on disk by page hash so re-uploads
+# and retried jobs never OCR the same page twice.
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def _lower_priority():
+    # Pool initializer: OCR yields the CPU to interactive queries in the same container
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+def get_pool() -> ProcessPoolExecutor:
+    # Spawned, not forked: the worker process already runs the I/O loop thread
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=get_context("spawn"),
+                                    initializer=_lower_priority)
+    return _pool
+
+def page_hash(doc: "fitz.Document", page: "fitz.Page") -> str:
+    # Content stream plus raw image streams: identical scans hash the same in any file
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{OCR_LANG}:{OCR_DPI}:".encode())
+    h.update(page.read_contents())
+    for img in page.get_images(full=True):
+        h.update(doc.xref_stream_raw(img[0]) or b"")
+    return h.hexdigest()
+
+def _cache_path(key: str) -> str:
+    return os.path.join(OCR_CACHE_DIR, key[:2], key + ".txt")
+
+def cached(key: str) -> Optional[str]:
+    try:
+        with open(_cache_path(key), encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def store(key: str, text: str):
+    path = _cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so concurrent workers never read a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def _ocr_page(pdf: bytes, dpi: int, lang: str) -> str:
+    # Runs in a pool process; `pdf` is a single-page document
+    with fitz.open(stream=pdf, filetype="pdf") as doc:
+        page = doc[0]
+        tp = page.get_textpage_ocr(dpi=dpi, language=lang, full=True)
+        return page.get_text(textpage=tp)
+
+def _single_page(doc: "fitz.Document", pno: int) -> bytes:
+    with fitz.open() as one:
+        one.insert_pdf(doc, from_page=pno, to_page=pno)
+        return one.tobytes()
+
+def ocr_pages(doc: "fitz.Document", pnos: List[int],
+              on_page: Optional[Callable[[], None]] = None) -> Tuple[Dict[int, str], Dict]:
+    """
+    OCRs the given pages, serving repeats from the cache. Returns text by
+    page number and a report: pages OCRed, served from cache, and failed
+    (with the first error, e.g. Tesseract missing). `on_page` is called as
+    each OCR task finishes, so a long scan can keep its job's heartbeat fresh.
+    """
+    texts: Dict[int, str] = {}
+    report = {"ocr_pages": [], "ocr_cached": 0, "ocr_failed": []}
+    window: deque = deque()  # bounded, so a long scan doesn't hold every page's bytes at once
+
+    def collect():
+        global _pool
+        pno, key, fut = window.popleft()
+        try:
+            texts[pno] = fut.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                _pool = None  # a crashed OCR process poisons the pool; the next page gets a fresh one
+            report["ocr_failed"].append(pno + 1)
+            report.setdefault("ocr_error", f"{type(e).__name__}: {e}"[:300])
+        else:
+            store(key, texts[pno])
+            report["ocr_pages"].append(pno + 1)
+        if on_page:
+            on_page()
+
+    for pno in pnos:
+        key = page_hash(doc, doc[pno])
+        hit = cached(key)
+        if hit is not None:
+            texts[pno] = hit
+            report["ocr_cached"] += 1
+            report["ocr_pages"].append(pno + 1)
+            continue
+        window.append((pno, key, get_pool().submit(_ocr_page, _single_page(doc, pno), OCR_DPI, OCR_LANG)))
+        if len(window) >= 2 * OCR_WORKERS:
+            collect()
+    while window:
+        collect()
+    report["ocr_pages"].sort()
+    return texts, report
@@ -1,10 +1,19 @@
 import numpy as np
-from typing import List, Dict, Tuple
-from config import TOP_K, TOP_N, HYBRID_ACCEPT
-from .store import fulltext, vector, get_context
-from .composer import embed_query
+import asyncio, threading, time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from config import TOP_K, TOP_N, HYBRID_ACCEPT, QUERY_REWRITES, QUERY_HYDE, QUERY_BUDGET_S
+from .aio import run
+from .store import afulltext, avector, aget_contexts
+from .cache import normalize_query
+from .composer import aembed_query, aembed_texts, arewrite_query
+from .models import SearchFilters
 
 ALPHA = 0.6  # semantic weight
+REWRITE_CACHE_SIZE = 1024
+
+_rewrite_cache: "OrderedDict[str, Tuple[List[str], Optional[str]]]" = OrderedDict()
+_rewrite_lock = threading.Lock()
 
 def normalize(scores: List[float]) -> List[float]:
     if not scores: return []
@@ -32,27 +41,83 @@ def mmr(cands: List[Dict], lam: float = 0.7, n: int = TOP_N) -> List[Dict]:
         remaining = [r for r in remaining if r is not best_item]
     return selected
 
-def retrieve_topn(question: str) -> Tuple[List[Dict], float]:
-    qvec = embed_query(question)
-    vec_rows = vector(qvec, TOP_K)
-    fts_rows = fulltext(question, TOP_K)
-
-    sem_scores = normalize([r['score'] for r in vec_rows])
-    lex_scores = normalize([r['score'] for r in fts_rows])
-
+async def _arewrites(question: str, timeout: float) -> Tuple[List[str], Optional[str]]:
+    key = normalize_query(question)
+    with _rewrite_lock:
+        if key in _rewrite_cache:
+            _rewrite_cache.move_to_end(key)
+            return _rewrite_cache[key]
+    out = await arewrite_query(question, QUERY_REWRITES, QUERY_HYDE, timeout)
+    with _rewrite_lock:
+        _rewrite_cache[key] = out
+        while len(_rewrite_cache) > REWRITE_CACHE_SIZE:
+            _rewrite_cache.popitem(last=False)
+    return out
+
+async def _aexpanded_searches(question: str, filters: Optional[SearchFilters], timeout: float) -> Tuple[List[List[Dict]], List[List[Dict]]]:
+    # Rewrites feed both searches; the HyDE passage only makes sense for the vector side.
+    rewrites, passage = await _arewrites(question, timeout)
+    vec_texts = rewrites + ([passage] if passage else [])
+    if not vec_texts:
+        return [], []
+    qvecs = await aembed_texts(vec_texts)
+    results = await asyncio.gather(
+        *[avector(v, TOP_K, filters) for v in qvecs],
+        *[afulltext(t, TOP_K, filters) for t in rewrites],
+        return_exceptions=True,  # e.g. a rewrite that is not valid Lucene syntax
+    )
+    ok = lambda rs: [r for r in rs if not isinstance(r, BaseException)]
+    return ok(results[:len(qvecs)]), ok(results[len(qvecs):])
+
+def _discard_result(task: "asyncio.Task"):
+    if not task.cancelled():
+        task.exception()  # mark as retrieved so a late failure is not logged as unhandled
+
+async def aretrieve_topn(
+    question: str,
+    filters: Optional[SearchFilters] = None,
+    qvec: Optional[List[float]] = None,
+) -> Tuple[List[Dict], float]:
+    deadline = time.monotonic() + QUERY_BUDGET_S
+    # Optional expansion runs concurrently with the plain searches and is
+    # dropped if it misses the latency budget (it keeps running so its rewrites get cached).
+    exp_task = None
+    if QUERY_REWRITES > 0 or QUERY_HYDE:
+        exp_task = asyncio.ensure_future(_aexpanded_searches(question, filters, QUERY_BUDGET_S))
+        exp_task.add_done_callback(_discard_result)
+    fts_task = asyncio.ensure_future(afulltext(question, TOP_K, filters))
+    fts_task.add_done_callback(_discard_result)  # not awaited if embedding or vector search raises first
+    if qvec is None:
+        qvec = await aembed_query(question)
+    # Filters are pushed down into both searches, so all TOP_K slots stay in scope
+    vec_lists = [await avector(qvec, TOP_K, filters)]
+    fts_lists = [await fts_task]
+    if exp_task is not None:
+        done, _ = await asyncio.wait({exp_task}, timeout=max(0.0, deadline - time.monotonic()))
+        if done and exp_task.exception() is None:
+            more_vec, more_fts = exp_task.result()
+            vec_lists += more_vec
+            fts_lists += more_fts
+
+    # Each result list is normalized on its own; a chunk keeps its best score across variants.
     by_id: Dict[str, Dict] = {}
-    for r, s in zip(vec_rows, sem_scores):
-        cid = r['chunk']['chunk_id']
-        by_id.setdefault(cid, {'sem':0, 'lex':0, 'cid':cid, 'vec':qvec})
-        by_id[cid]['sem'] = max(by_id[cid]['sem'], s)
-    for r, l in zip(fts_rows, lex_scores):
-        cid = r['chunk']['chunk_id']
-        by_id.setdefault(cid, {'sem':0, 'lex':0, 'cid':cid, 'vec':qvec})
-        by_id[cid]['lex'] = max(by_id[cid]['lex'], l)
+    for rows in vec_lists:
+        for r, s in zip(rows, normalize([r['score'] for r in rows])):
+            cid = r['chunk']['chunk_id']
+            by_id.setdefault(cid, {'sem':0, 'lex':0, 'cid':cid, 'vec':qvec})
+            by_id[cid]['sem'] = max(by_id[cid]['sem'], s)
+            by_id[cid]['emb'] = r['chunk'].get('embedding')
+    for rows in fts_lists:
+        for r, l in zip(rows, normalize([r['score'] for r in rows])):
+            cid = r['chunk']['chunk_id']
+            by_id.setdefault(cid, {'sem':0, 'lex':0, 'cid':cid, 'vec':qvec})
+            by_id[cid]['lex'] = max(by_id[cid]['lex'], l)
+            by_id[cid].setdefault('emb', r['chunk'].get('embedding'))
 
     cands = []
+    recs = await aget_contexts(list(by_id))
     for cid, d in by_id.items():
-        rec = get_context(cid)
+        rec = recs.get(cid)
         if not rec: 
             continue
         hybrid = ALPHA*d['sem'] + (1-ALPHA)*d['lex']
@@ -76,7 +141,9 @@ def retrieve_topn(question: str) -> Tuple[List[Dict], float]:
 
             'end': rec['e'],
 
-            'vec': qvec
+            'vec': qvec,
+
+            'emb': d.get('emb'),
 
         })
 
@@ -84,3 +151,10 @@ def retrieve_topn(question: str) -> Tuple[List[Dict], float]:
     top = mmr(cands, n=TOP_N)
     best = top[0]['hybrid'] if top else 0.0
     return top, best
+
+def retrieve_topn(
+    question: str,
+    filters: Optional[SearchFilters] = None,
+    qvec: Optional[List[float]] = None,
+) -> Tuple[List[Dict], float]:
+    return run(aretrieve_topn(question, filters, qvec))
@@ -0,0 +1,92 @@
+import re
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import TOP_N, CONVO_TURNS, WARM_POOL_SIZE, WARM_ACCEPT, FOLLOW_UP_MAX_WORDS
+from .aio import run
+from .composer import aembed_query, acondense_question
+from .models import SearchFilters
+from .retriever import aretrieve_topn
+
+# Words that usually point back at earlier turns ("it", "the second one", "what else")
+_REFERENCES = re.compile(
+    r"\b(it|its|they|them|their|theirs|this|these|those|he|she|his|her|ones|"
+    r"first|second|third|last|former|latter|above|previous|earlier|same|else)\b",
+    re.IGNORECASE,
+)
+
+def looks_like_follow_up(question: str) -> bool:
+    # Cheap gate for the condensation call: short questions or ones with back-references
+    return len(question.split()) <= FOLLOW_UP_MAX_WORDS or bool(_REFERENCES.search(question))
+
+class ConversationContext:
+    """
+    Per-session retrieval state: the last few turns (to condense follow-ups)
+    and a bounded warm pool of already-hydrated chunks with their embeddings.
+    Lives in st.session_state, so it is plain Python and numpy only.
+    """
+
+    def __init__(self, max_turns: int = CONVO_TURNS, max_chunks: int = WARM_POOL_SIZE):
+        self.turns: deque = deque(maxlen=max_turns)
+        self.pool: "OrderedDict[str, Dict]" = OrderedDict()
+        self.max_chunks = max_chunks
+
+    def remember(self, question: str, answer: str, top: List[Dict]):
+        self.turns.append((question, answer))
+        for c in top or []:
+            if c.get('emb') is None:
+                if c['cid'] in self.pool:
+                    self.pool.move_to_end(c['cid'])
+                continue
+            item = {k: v for k, v in c.items() if k not in ('vec', 'emb')}
+            item['emb'] = np.asarray(c['emb'], dtype=np.float32)
+            self.pool[c['cid']] = item
+            self.pool.move_to_end(c['cid'])
+        while len(self.pool) > self.max_chunks:
+            self.pool.popitem(last=False)
+
+    def warm_hits(self, qvec: List[float], n: int = TOP_N, floor: float = WARM_ACCEPT) -> Tuple[List[Dict], float]:
+        # Only chunks at least `floor` similar are returned; the rest would be unrelated sources
+        if not self.pool:
+            return [], 0.0
+        items = list(self.pool.values())
+        mat = np.stack([i['emb'] for i in items])
+        q = np.asarray(qvec, dtype=np.float32)
+        sims = mat @ q / (np.linalg.norm(mat, axis=1) * np.linalg.norm(q) + 1e-9)
+        order = [i for i in np.argsort(-sims)[:n] if sims[i] >= floor]
+        # Hits keep their 'emb' reference, so remember() refreshes reused chunks in the LRU order
+        top = [{**items[i], 'hybrid': float(sims[i])} for i in order]
+        return top, (top[0]['hybrid'] if top else 0.0)
+
+async def aretrieve_with_context(
+    question: str,
+    ctx: ConversationContext,
+    filters: Optional[SearchFilters] = None,
+) -> Tuple[List[Dict], float, str]:
+    """
+    Retrieval for one chat turn. Questions that look like follow-ups are
+    condensed into a standalone question; when they refer back to earlier
+    answers and the cached chunks match well enough, they are answered from
+    the warm pool without running vector or fulltext search. Other questions
+    skip the condensation call. Returns (top, best, standalone_question).
+    """
+    if not ctx.turns or not looks_like_follow_up(question):
+        top, best = await aretrieve_topn(question, filters)
+        return top, best, question
+
+    standalone, follow_up = await acondense_question(question, list(ctx.turns))
+    qvec = await aembed_query(standalone)
+    # Cached chunks were retrieved under whatever scope was active then, so only reuse them unscoped
+    if follow_up and (filters is None or filters.is_empty()):
+        top, best = ctx.warm_hits(qvec)
+        if top and best >= WARM_ACCEPT:
+            return top, best, standalone
+    top, best = await aretrieve_topn(standalone, filters, qvec=qvec)
+    return top, best, standalone
+
+def retrieve_with_context(
+    question: str,
+    ctx: ConversationContext,
+    filters: Optional[SearchFilters] = None,
+) -> Tuple[List[Dict], float, str]:
+    return run(aretrieve_with_context(question, ctx, filters))
@@ -0,0 +1,295 @@
+"""
+Columnar snapshots of the corpus: one row per chunk with its case-study
+metadata and its embedding as a fixed-width float32 column.
+
+    python -m rag.snapshot export corpus.parquet      # or corpus.arrow (Arrow IPC)
+    python -m rag.snapshot import corpus.parquet      # batched UNWIND writes, no API calls
+    python -m rag.snapshot convert corpus.parquet corpus.arrow
+    python -m rag.snapshot search corpus.arrow "question"
+
+Each case study's own properties and its graph neighbourhood from the Neo4J/
+notebook (company, county, grant program, technology and outcome tags) ride
+along as JSON on the row of its first chunk, so a restore is not chunk-only.
+
+Parquet (zstd) is the compact format for storage and transfer. Arrow IPC files
+are uncompressed and can be memory-mapped, so LocalIndex searches them in
+place without loading the corpus into memory or Neo4j.
+"""
+import argparse, json, time
+from typing import Callable, Dict, Iterator, List, Optional
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import EMBED_DIM, EMBED_MODEL, TOP_K, DEDUP_ENABLED
+from .aio import run
+from .dedup import Deduper
+from .store import afetch, aupsert_chunks, aensure_indexes, aindex_version, abump_index_version
+
+FORMAT = "conexus-snapshot/2"
+READABLE = {"conexus-snapshot/1", FORMAT}   # /1 files have no case_graph column
+EXPORT_PAGE = 1000      # chunks per export query / row group
+IMPORT_BATCH = 500      # chunks per UNWIND write
+
+# Keyset pagination on chunk_id (backed by chunk_id_idx), so every page is an index seek
+EXPORT_PAGE_QUERY = """
+MATCH (cs:CaseStudy)-[:HAS_CHUNK]->(c:Chunk)
+WHERE c.chunk_id > $after
+WITH cs, c ORDER BY c.chunk_id LIMIT $limit
+RETURN cs.case_id AS case_id, cs.title AS title, cs.url AS url, cs.industry AS industry,
+       cs.year AS year, coalesce(cs.tags, []) AS tags,
+       c.chunk_id AS chunk_id, c.text AS text, c.order AS order, c.char_start AS start,
+       c.char_end AS end, c.dup_of AS dup_of, c.embedding AS embedding,
+       NOT EXISTS { MATCH (cs)-[:HAS_CHUNK]->(o:Chunk) WHERE o.chunk_id < c.chunk_id } AS first_of_case
+"""
+
+# Everything about a case study beyond its chunks, written once per case
+CASE_GRAPH_QUERY = """
+UNWIND $case_ids AS cid
+MATCH (cs:CaseStudy {case_id: cid})
+RETURN cid AS case_id, properties(cs) AS props,
+       [(co:Company)-[:HAS_CASE_STUDY]->(cs) |
+        {props: properties(co), counties: [(co)-[:HEADQUARTERED_IN]->(x:County) | properties(x)]}] AS companies,
+       [(cs)-[:AWARDED_UNDER]->(g:GrantProgram) | properties(g)] AS programs,
+       [(cs)-[:USES_TECH]->(t:TagTech) | t.name] AS tech_tags,
+       [(cs)-[:HAS_OUTCOME]->(t:TagOutcome) | t.name] AS outcome_tags
+"""
+
+# Same MERGE keys as the notebook's loader (company_id, County/GrantProgram/Tag name)
+RESTORE_CASE_GRAPH = """
+UNWIND $cases AS g
+MATCH (cs:CaseStudy {case_id: g.case_id})
+SET cs += g.props
+FOREACH (co IN [x IN g.companies WHERE x.props.company_id IS NOT NULL] |
+  MERGE (c:Company {company_id: co.props.company_id})
+  SET c += co.props
+  MERGE (c)-[:HAS_CASE_STUDY]->(cs)
+  FOREACH (cty IN [x IN co.counties WHERE x.name IS NOT NULL] |
+    MERGE (x:County {name: cty.name})
+    SET x += cty
+    MERGE (c)-[:HEADQUARTERED_IN]->(x)))
+FOREACH (p IN [x IN g.programs WHERE x.name IS NOT NULL] |
+  MERGE (x:GrantProgram {name: p.name})
+  SET x += p
+  MERGE (cs)-[:AWARDED_UNDER]->(x))
+FOREACH (n IN g.tech_tags | MERGE (t:TagTech {name: n}) MERGE (cs)-[:USES_TECH]->(t))
+FOREACH (n IN g.outcome_tags | MERGE (t:TagOutcome {name: n}) MERGE (cs)-[:HAS_OUTCOME]->(t))
+"""
+
+# Duplicates can come before their canonical chunk in chunk_id order; link them once all are written
+LINK_DUPLICATES = """
+MATCH (c:Chunk) WHERE c.dup_of IS NOT NULL AND NOT (c)-[:DUPLICATE_OF]->()
+MATCH (canon:Chunk {chunk_id: c.dup_of})
+MERGE (c)-[:DUPLICATE_OF]->(canon)
+"""
+
+def schema(dim: int, metadata: Optional[Dict[str, str]] = None) -> pa.Schema:
+    return pa.schema([
+        ("case_id", pa.string()), ("title", pa.string()), ("url", pa.string()),
+        ("industry", pa.string()), ("year", pa.int32()), ("tags", pa.list_(pa.string())),
+        ("chunk_id", pa.string()), ("text", pa.string()), ("order", pa.int32()),
+        ("start", pa.int32()), ("end", pa.int32()), ("dup_of", pa.string()),
+        ("case_graph", pa.string()),   # JSON, on the first chunk of each case only
+        ("embedding", pa.list_(pa.float32(), dim)),
+    ], metadata=metadata)
+
+def _embedding_array(embs: List[Optional[List[float]]], dim: int) -> pa.Array:
+    # Null rows (linked duplicates) still get zeroed values, so the child buffer has no nulls and maps as one matrix
+    valid = np.array([e is not None for e in embs], dtype=bool)
+    mat = np.zeros((len(embs), dim), dtype=np.float32)
+    for i, e in enumerate(embs):
+        if e is not None:
+            if len(e) != dim:
+                raise ValueError(f"embedding of size {len(e)} in a {dim}-dimension snapshot; run `python -m rag.indexes check`")
+            mat[i] = e
+    validity = None if valid.all() else pa.array(valid).buffers()[1]
+    return pa.Array.from_buffers(pa.list_(pa.float32(), dim), len(embs), [validity],
+                                 children=[pa.array(mat.reshape(-1))])
+
+def _to_batch(rows: List[Dict], sch: pa.Schema, dim: int) -> pa.RecordBatch:
+    cols = [pa.array([r[f.name] for r in rows], type=f.type) for f in sch if f.name != "embedding"]
+    cols.append(_embedding_array([r["embedding"] for r in rows], dim))
+    return pa.RecordBatch.from_arrays(cols, schema=sch)
+
+def _writer(path: str, sch: pa.Schema):
+    if path.endswith(".parquet"):
+        return pq.ParquetWriter(path, sch, compression="zstd")
+    return pa.ipc.new_file(pa.OSFile(path, "wb"), sch)
+
+async def _aattach_case_graphs(rows: List[Dict]):
+    firsts = [r["case_id"] for r in rows if r.pop("first_of_case")]
+    graphs = {g.pop("case_id"): g for g in await afetch(CASE_GRAPH_QUERY, case_ids=firsts)} if firsts else {}
+    for r in rows:
+        g = graphs.pop(r["case_id"], None)
+        r["case_graph"] = json.dumps(g, default=str) if g is not None else None
+
+async def aexport_snapshot(path: str, dim: int = EMBED_DIM,
+                           on_page: Optional[Callable[[int], None]] = None) -> int:
+    """Writes every CaseStudy/Chunk pair to `path` (.parquet or .arrow); returns the chunk count."""
+    meta = {"format": FORMAT, "embed_dim": str(dim), "embed_model": EMBED_MODEL,
+            "exported_at": str(int(time.time())), "index_version": str(await aindex_version())}
+    sch = schema(dim, meta)
+    writer = _writer(path, sch)
+    n, after = 0, ""
+    try:
+        while True:
+            rows = await afetch(EXPORT_PAGE_QUERY, after=after, limit=EXPORT_PAGE)
+            if not rows:
+                break
+            await _aattach_case_graphs(rows)
+            writer.write_batch(_to_batch(rows, sch, dim))
+            n += len(rows)
+            after = rows[-1]["chunk_id"]
+            if on_page:
+                on_page(n)
+    finally:
+        writer.close()
+    return n
+
+def snapshot_metadata(path: str) -> Dict[str, str]:
+    if path.endswith(".parquet"):
+        raw = pq.ParquetFile(path).schema_arrow.metadata or {}
+    else:
+        raw = pa.ipc.open_file(pa.memory_map(path)).schema.metadata or {}
+    return {k.decode(): v.decode() for k, v in raw.items()}
+
+def iter_batches(path: str, size: int = IMPORT_BATCH) -> Iterator[pa.RecordBatch]:
+    if path.endswith(".parquet"):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=size)
+        return
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    for i in range(reader.num_record_batches):
+        b = reader.get_batch(i)
+        for off in range(0, b.num_rows, size):
+            yield b.slice(off, size)
+
+def _matrix(col: pa.FixedSizeListArray, dim: int) -> np.ndarray:
+    # Zero-copy view of the embedding block (.values ignores the array offset, so apply it here)
+    return col.values.slice(col.offset * dim, len(col) * dim).to_numpy(zero_copy_only=False).reshape(-1, dim)
+
+def batch_rows(batch: pa.RecordBatch, dim: int) -> List[Dict]:
+    names = [n for n in batch.schema.names if n != "embedding"]
+    cols = {n: batch.column(n).to_pylist() for n in names}
+    emb = batch.column("embedding")
+    mat, valid = _matrix(emb, dim), emb.is_valid().to_numpy(zero_copy_only=False)
+    return [{**{n: cols[n][i] for n in names}, "embedding": mat[i].tolist() if valid[i] else None}
+            for i in range(batch.num_rows)]
+
+async def aimport_snapshot(path: str, batch: int = IMPORT_BATCH,
+                           on_batch: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Restores a snapshot into Neo4j through the ingest write path (batched
+    UNWIND upserts), then each case study's properties and graph neighbourhood.
+    Embeddings come from the file, so no API calls are made.
+    """
+    meta = snapshot_metadata(path)
+    if meta.get("format") not in READABLE:
+        raise ValueError(f"{path} is not a {FORMAT} file")
+    dim = int(meta["embed_dim"])
+    if dim != EMBED_DIM:
+        raise ValueError(f"snapshot has {dim}-dimension embeddings but EMBED_DIM is {EMBED_DIM}")
+    await aensure_indexes(dim)
+    # Restored chunks also seed the near-duplicate index, so later uploads are matched against them
+    deduper = Deduper() if DEDUP_ENABLED else None
+    n = 0
+    for b in iter_batches(path, batch):
+        rows = batch_rows(b, dim)
+        await aupsert_chunks(rows)
+        cases = [{"case_id": r["case_id"], **json.loads(r["case_graph"])} for r in rows if r.get("case_graph")]
+        if cases:
+            await afetch(RESTORE_CASE_GRAPH, cases=cases)
+        if deduper is not None:
+            deduper.register(rows)
+        n += len(rows)
+        if on_batch:
+            on_batch(n)
+    await afetch(LINK_DUPLICATES)
+    await abump_index_version()
+    return n
+
+def export_snapshot(path: str, dim: int = EMBED_DIM) -> int:
+    return run(aexport_snapshot(path, dim))
+
+def import_snapshot(path: str, batch: int = IMPORT_BATCH) -> int:
+    return run(aimport_snapshot(path, batch))
+
+def convert(src: str, dst: str) -> int:
+    # Parquet <-> Arrow IPC, batch by batch
+    sch = pq.ParquetFile(src).schema_arrow if src.endswith(".parquet") else pa.ipc.open_file(pa.memory_map(src)).schema
+    writer = _writer(dst, sch)
+    n = 0
+    try:
+        for b in iter_batches(src, EXPORT_PAGE):
+            writer.write_batch(b)
+            n += b.num_rows
+    finally:
+        writer.close()
+    return n
+
+class LocalIndex:
+    """
+    Exact cosine search over a memory-mapped Arrow IPC snapshot. Embeddings
+    are read in place (one zero-copy matrix per record batch); only the norms
+    and the hits' rows are materialized. For offline work and benchmarks.
+    """
+
+    def __init__(self, path: str):
+        if path.endswith(".parquet"):
+            raise ValueError("LocalIndex needs an Arrow IPC snapshot; run `python -m rag.snapshot convert` first")
+        self.meta = snapshot_metadata(path)
+        self.dim = int(self.meta["embed_dim"])
+        self.table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        self._blocks = []
+        for col in self.table.column("embedding").chunks:
+            mat = _matrix(col, self.dim)
+            norms = np.linalg.norm(mat, axis=1)
+            valid = col.is_valid().to_numpy(zero_copy_only=False) & (norms > 0)  # linked duplicates have no embedding
+            self._blocks.append((mat, np.where(valid, norms, 1.0), valid))
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def search(self, qvec: List[float], k: int = TOP_K) -> List[Dict]:
+        q = np.asarray(qvec, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        scores = (np.concatenate([np.where(valid, mat @ q / norms, -np.inf) for mat, norms, valid in self._blocks])
+                  if self._blocks else np.empty(0))
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = self.table.select(["chunk_id", "case_id", "title", "url", "text"]).take(pa.array(top)).to_pylist()
+        return [{**r, "score": float(scores[i])} for r, i in zip(rows, top)]
+
+def _progress(label: str) -> Callable[[int], None]:
+    return lambda n: print(f"  {label} {n} chunks", flush=True)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Export, import and search corpus snapshots.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("export").add_argument("path", help="*.parquet or *.arrow")
+    p = sub.add_parser("import")
+    p.add_argument("path")
+    p.add_argument("--batch", type=int, default=IMPORT_BATCH)
+    p = sub.add_parser("convert")
+    p.add_argument("src"); p.add_argument("dst")
+    p = sub.add_parser("search")
+    p.add_argument("path", help="*.arrow snapshot")
+    p.add_argument("question")
+    p.add_argument("-k", type=int, default=TOP_K)
+    args = ap.parse_args()
+    t0 = time.perf_counter()
+    if args.command == "export":
+        n = run(aexport_snapshot(args.path, on_page=_progress("exported")))
+        print(f"exported {n} chunks to {args.path} in {time.perf_counter() - t0:.1f}s")
+    elif args.command == "import":
+        n = run(aimport_snapshot(args.path, args.batch, on_batch=_progress("imported")))
+        print(f"imported {n} chunks from {args.path} in {time.perf_counter() - t0:.1f}s")
+    elif args.command == "convert":
+        print(f"converted {convert(args.src, args.dst)} chunks to {args.dst}")
+    else:
+        from .composer import embed_query
+        index = LocalIndex(args.path)
+        for hit in index.search(embed_query(args.question), args.k):
+            print(f"{hit['score']:.3f}  {hit['chunk_id']}  {hit['title']}\n       {hit['text'][:160]!r}")
+        print(json.dumps({"chunks": len(index), "seconds": round(time.perf_counter() - t0, 3)}))
@@ -1,55 +1,347 @@
-from neo4j import GraphDatabase
-from typing import List
-from config import NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD
+from neo4j import AsyncDriver, AsyncGraphDatabase
+from typing import Dict, List, Optional, Tuple
+import hashlib, threading, time
+import numpy as np
+from config import (NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD, NEO4J_MAX_POOL, CACHE_TTL_S,
+                    CACHE_SEARCH_MB, CACHE_CHUNK_MB, INDEX_VERSION_TTL_S)
+from .aio import run
+from .cache import TTLCache, normalize_query
+from .models import SearchFilters
 
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+# All queries go through one async driver on the shared I/O loop (rag.aio).
+# Every public function has an `a`-prefixed coroutine and a sync adapter.
+_driver: Optional[AsyncDriver] = None
 
-def get_session():
-    return driver.session()
+def get_driver() -> AsyncDriver:
+    # Created lazily so it binds to the shared loop on first use
+    global _driver
+    if _driver is None:
+        _driver = AsyncGraphDatabase.driver(
+            NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), max_connection_pool_size=NEO4J_MAX_POOL)
+    return _driver
 
-CREATE_FTS = "CREATE FULLTEXT INDEX chunk_text_fts IF NOT EXISTS FOR (c:Chunk) ON EACH [c.text]"
-CREATE_VEC = "CREATE VECTOR INDEX chunk_vec_idx IF NOT EXISTS FOR (c:Chunk) ON (c.embedding) OPTIONS { indexConfig: {`vector.dimensions`: $dim, `vector.similarity_function`: 'cosine'}}"
+# Sessions currently holding (or waiting for) a pooled connection; only touched on the I/O loop
+_pool = {"in_flight": 0, "peak": 0}
 
-def ensure_indexes(dim: int):
-    with get_session() as s:
-        s.run(CREATE_FTS)
-        s.run(CREATE_VEC, dim=dim)
+def pool_stats() -> Dict[str, int]:
+    return {**_pool, "max_size": NEO4J_MAX_POOL}
+
+async def afetch(query: str, **params) -> List[Dict]:
+    _pool["in_flight"] += 1
+    _pool["peak"] = max(_pool["peak"], _pool["in_flight"])
+    try:
+        async with get_driver().session() as s:
+            res = await s.run(query, **params)
+            return await res.data()
+    finally:
+        _pool["in_flight"] -= 1
+
+def fetch(query: str, **params) -> List[Dict]:
+    return run(afetch(query, **params))
+
+# Search index names and labels are templated: Neo4j allows one index per label and property, so
+# rag.indexes rebuilds over a fresh label (added to every chunk) and swaps the active pair (see Meta)
+FTS_INDEX = "chunk_text_fts"
+VEC_INDEX = "chunk_vec_idx"
+CREATE_FTS = "CREATE FULLTEXT INDEX {name} IF NOT EXISTS FOR (c:{label}) ON EACH [c.text]"
+CREATE_VEC = "CREATE VECTOR INDEX {name} IF NOT EXISTS FOR (c:{label}) ON (c.embedding) OPTIONS { indexConfig: {`vector.dimensions`: $dim, `vector.similarity_function`: 'cosine'}}"
+
+# Range indexes backing chunk lookups, neighbor expansion and metadata-scoped retrieval (see SearchFilters)
+CREATE_META = [
+    "CREATE INDEX chunk_id_idx IF NOT EXISTS FOR (c:Chunk) ON (c.chunk_id)",
+    "CREATE INDEX case_id_idx IF NOT EXISTS FOR (cs:CaseStudy) ON (cs.case_id)",
+    "CREATE INDEX chunk_case_order_idx IF NOT EXISTS FOR (c:Chunk) ON (c.case_id, c.order)",
+    "CREATE INDEX chunk_case_id_idx IF NOT EXISTS FOR (c:Chunk) ON (c.case_id)",
+    "CREATE INDEX chunk_industry_idx IF NOT EXISTS FOR (c:Chunk) ON (c.industry)",
+    "CREATE INDEX chunk_year_idx IF NOT EXISTS FOR (c:Chunk) ON (c.year)",
+    "CREATE INDEX case_industry_idx IF NOT EXISTS FOR (cs:CaseStudy) ON (cs.industry)",
+    "CREATE INDEX case_year_idx IF NOT EXISTS FOR (cs:CaseStudy) ON (cs.year)",
+]
+
+# Scope metadata of a case study. Uploads store it on the CaseStudy; case studies loaded by
+# the Neo4J/ notebook keep it in the graph: Company.industry_sector, award_year and tag nodes.
+CASE_META = """
+OPTIONAL MATCH (co:Company)-[:HAS_CASE_STUDY]->(cs)
+WITH cs, [s IN collect(co.industry_sector) WHERE s IS NOT NULL] AS sectors
+OPTIONAL MATCH (cs)-[:USES_TECH|HAS_OUTCOME]->(t)
+WITH cs, sectors, [n IN collect(DISTINCT toLower(trim(t.name))) WHERE n IS NOT NULL] AS graph_tags
+WITH cs, coalesce(cs.industry, toLower(trim(head(sectors)))) AS industry,
+     coalesce(cs.year, toInteger(cs.award_year)) AS year,
+     CASE WHEN size(coalesce(cs.tags, [])) > 0 THEN cs.tags ELSE graph_tags END AS tags
+"""
+
+# Fills CaseStudy metadata from the graph where it is missing
+SYNC_CASE_META = """
+MATCH (cs:CaseStudy)
+WHERE cs.industry IS NULL OR cs.year IS NULL OR cs.tags IS NULL
+CALL {
+  WITH cs
+""" + CASE_META + """
+  SET cs.industry = industry, cs.year = year, cs.tags = tags
+} IN TRANSACTIONS OF 1000 ROWS
+"""
+
+# Copies CaseStudy metadata onto chunks ingested before it was denormalized, or written before it changed
+SYNC_CHUNK_META = """
+MATCH (cs:CaseStudy)-[:HAS_CHUNK]->(c:Chunk)
+WHERE c.case_id IS NULL OR coalesce(c.industry, '') <> coalesce(cs.industry, '')
+   OR coalesce(c.year, -1) <> coalesce(cs.year, -1) OR coalesce(c.tags, []) <> coalesce(cs.tags, [])
+CALL {
+  WITH cs, c
+  SET c.case_id = cs.case_id, c.industry = cs.industry, c.year = cs.year, c.tags = coalesce(cs.tags, [])
+} IN TRANSACTIONS OF 1000 ROWS
+"""
+
+# After a rebuild the search indexes cover a rebuild label; chunks written outside
+# aupsert_chunks (the Neo4J/ notebook) lack it until this runs
+LABEL_CHUNKS = """
+MATCH (c:Chunk) WHERE NOT c:{label}
+CALL {
+  WITH c
+  SET c:{label}
+} IN TRANSACTIONS OF 10000 ROWS
+"""
+
+def active_labels(meta: Dict) -> List[str]:
+    return sorted({meta["fts_label"], meta["vec_label"]} - {"Chunk"})
+
+async def aensure_indexes(dim: int):
+    meta = await _aindex_meta()
+    for label in active_labels(meta):
+        await afetch(LABEL_CHUNKS.replace("{label}", label))
+    await afetch(CREATE_FTS.replace("{name}", meta["fts"]).replace("{label}", meta["fts_label"]))
+    await afetch(CREATE_VEC.replace("{name}", meta["vec"]).replace("{label}", meta["vec_label"]), dim=dim)
+    for q in CREATE_META:
+        await afetch(q)
+    await afetch(SYNC_CASE_META)
+    await afetch(SYNC_CHUNK_META)
 
-UPSERT_CHUNK = """
+def ensure_indexes(dim: int):
+    run(aensure_indexes(dim))
 
-MERGE (cs:CaseStudy {case_id: $case_id})
-ON CREATE SET cs.title=$title, cs.url=$url
-MERGE (ch:Chunk {chunk_id: $chunk_id})
-SET ch.text=$text, ch.order=$order, ch.char_start=$start, ch.char_end=$end, ch.embedding=$embedding
+# One round trip per batch of chunks. Blank upload metadata keeps what the case study has;
+# chunks copy it from the case study, and earlier chunks of the case are brought in line.
+UPSERT_CHUNKS = """
+UNWIND $rows AS row
+MERGE (cs:CaseStudy {case_id: row.case_id})
+ON CREATE SET cs.title=row.title, cs.url=row.url
+SET cs.industry=coalesce(row.industry, cs.industry), cs.year=coalesce(row.year, cs.year),
+    cs.tags=CASE WHEN size(row.tags) > 0 THEN row.tags ELSE coalesce(cs.tags, []) END
+MERGE (ch:Chunk {chunk_id: row.chunk_id})
+{labels}
+SET ch.text=row.text, ch.order=row.order, ch.char_start=row.start, ch.char_end=row.end, ch.embedding=row.embedding,
+    ch.case_id=cs.case_id, ch.industry=cs.industry, ch.year=cs.year, ch.tags=cs.tags, ch.dup_of=row.dup_of
 MERGE (cs)-[:HAS_CHUNK]->(ch)
-RETURN ch
+WITH ch, row
+OPTIONAL MATCH (ch)-[old:DUPLICATE_OF]->()
+DELETE old
+WITH DISTINCT ch, row
+OPTIONAL MATCH (canon:Chunk {chunk_id: row.dup_of})
+FOREACH (_ IN CASE WHEN canon IS NULL THEN [] ELSE [1] END | MERGE (ch)-[:DUPLICATE_OF]->(canon))
+WITH DISTINCT row.case_id AS case_id
+MATCH (cs:CaseStudy {case_id: case_id})-[:HAS_CHUNK]->(sib:Chunk)
+WHERE coalesce(sib.industry, '') <> coalesce(cs.industry, '')
+   OR coalesce(sib.year, -1) <> coalesce(cs.year, -1) OR coalesce(sib.tags, []) <> coalesce(cs.tags, [])
+SET sib.industry=cs.industry, sib.year=cs.year, sib.tags=cs.tags
 """
 
+async def aupsert_chunks(recs: List[dict]):
+    rows = [{"industry": None, "year": None, "tags": [], "dup_of": None, **r} for r in recs]
+    # Chunks carry the search indexes' labels, including one being rebuilt
+    meta = await _aindex_meta()
+    labels = sorted({meta["fts_label"], meta["vec_label"], *meta["pending_labels"]} - {"Chunk"})
+    await afetch(UPSERT_CHUNKS.replace("{labels}", "SET ch:" + ":".join(labels) if labels else ""), rows=rows)
+
+def upsert_chunks(recs: List[dict]):
+    run(aupsert_chunks(recs))
+
 def upsert_chunk(rec: dict):
-    with get_session() as s:
-        s.run(UPSERT_CHUNK, **rec)
+    upsert_chunks([rec])
+
+# Canonical chunks a near-duplicate may be linked to: present and embedded
+EXISTING_CANONICAL = """
+UNWIND $chunk_ids AS cid
+MATCH (c:Chunk {chunk_id: cid})
+WHERE c.embedding IS NOT NULL
+RETURN c.chunk_id AS chunk_id
+"""
+
+async def aexisting_canonical(chunk_ids: List[str]) -> set:
+    return {r["chunk_id"] for r in await afetch(EXISTING_CANONICAL, chunk_ids=chunk_ids)}
+
+# --- Change marker: bumped once per ingestion so caches can key on it ---
+GET_INDEX_VERSION = """
+OPTIONAL MATCH (m:Meta {key: 'index'})
+RETURN coalesce(m.version, 0) AS version,
+       coalesce(m.fts_index, 'chunk_text_fts') AS fts, coalesce(m.vec_index, 'chunk_vec_idx') AS vec,
+       coalesce(m.fts_label, 'Chunk') AS fts_label, coalesce(m.vec_label, 'Chunk') AS vec_label,
+       coalesce(m.pending_labels, []) AS pending_labels
+"""
+
+BUMP_INDEX_VERSION = """
+MERGE (m:Meta {key: 'index'})
+SET m.version = coalesce(m.version, 0) + 1
+RETURN m.version AS version
+"""
+
+_version = {"value": 0, "fts": FTS_INDEX, "vec": VEC_INDEX, "fts_label": "Chunk", "vec_label": "Chunk",
+            "pending_labels": [], "checked": float("-inf")}
+_version_lock = threading.Lock()
+
+async def _aindex_meta() -> Dict:
+    # Re-read at most every INDEX_VERSION_TTL_S, so ingestion or an index swap in
+    # another process (or container) reaches this process within that window.
+    with _version_lock:
+        if time.monotonic() - _version["checked"] < INDEX_VERSION_TTL_S:
+            return dict(_version)
+    row = (await afetch(GET_INDEX_VERSION))[0]
+    with _version_lock:
+        _version.update(value=int(row["version"]), fts=row["fts"], vec=row["vec"], fts_label=row["fts_label"],
+                        vec_label=row["vec_label"], pending_labels=list(row["pending_labels"]), checked=time.monotonic())
+        return dict(_version)
+
+async def aindex_version() -> int:
+    return (await _aindex_meta())["value"]
+
+async def aactive_indexes() -> Tuple[str, str]:
+    # (fulltext, vector) index names searches should query
+    meta = await _aindex_meta()
+    return meta["fts"], meta["vec"]
+
+def set_index_meta(**values):
+    # Called after this process changed the Meta node itself
+    with _version_lock:
+        _version.update(values, checked=time.monotonic())
 
+async def abump_index_version() -> int:
+    value = int((await afetch(BUMP_INDEX_VERSION))[0]["version"])
+    set_index_meta(value=value)
+    return value
+
+def index_version() -> int:
+    return run(aindex_version())
+
+def bump_index_version() -> int:
+    return run(abump_index_version())
+
+# --- Process-wide caches, shared by all sessions; keys carry the index version ---
+SEARCH_CACHE = TTLCache("searches", CACHE_SEARCH_MB * 2**20, CACHE_TTL_S)
+CHUNK_CACHE = TTLCache("chunks", CACHE_CHUNK_MB * 2**20, CACHE_TTL_S)
+
+# Searches only return what ranking needs (id + embedding), never the chunk text.
+# Near-duplicates (dup_of) have no embedding, so only fulltext needs to skip them.
 FIND_FTS = """
 
-CALL db.index.fulltext.queryNodes('chunk_text_fts', $q) YIELD node, score
-RETURN node AS chunk, score
+CALL db.index.fulltext.queryNodes($fts_index, $q) YIELD node, score
+WHERE node.dup_of IS NULL
+RETURN node {.chunk_id, .embedding} AS chunk, score
 LIMIT $k
 """
 
 FIND_VEC = """
 
-CALL db.index.vector.queryNodes('chunk_vec_idx', $k, $qvec)
+CALL db.index.vector.queryNodes($vec_index, $k, $qvec)
 YIELD node, score
-RETURN node AS chunk, score
+RETURN node {.chunk_id, .embedding} AS chunk, score
+"""
+
+# Scoped variants. Fulltext hits stream out of Lucene in score order, so the
+# WHERE runs before LIMIT and every one of the k slots is on-target. The vector
+# index cannot pre-filter, so scoped vector search scores the (index-backed)
+# candidate set exactly instead of over-fetching and discarding.
+# A linked duplicate is skipped only when its canonical chunk is in scope too; otherwise it
+# stands in for it (scored with the canonical embedding), so a re-uploaded document whose
+# chunks all link to another case stays searchable within its own scope.
+FIND_FTS_SCOPED = """
+
+CALL db.index.fulltext.queryNodes($fts_index, $q) YIELD node, score
+WHERE {where}
+OPTIONAL MATCH (node)-[:DUPLICATE_OF]->(canon:Chunk)
+WITH node, canon, score
+WHERE canon IS NULL OR NOT ({canon_where})
+RETURN node {.chunk_id, embedding: coalesce(node.embedding, canon.embedding)} AS chunk, score
+LIMIT $k
 """
 
-def fulltext(q: str, k: int):
-    with get_session() as s:
-        return s.run(FIND_FTS, q=q, k=k).data()
+FIND_VEC_SCOPED = """
+
+MATCH (node:Chunk)
+WHERE {where}
+OPTIONAL MATCH (node)-[:DUPLICATE_OF]->(canon:Chunk)
+WITH node, canon, coalesce(node.embedding, canon.embedding) AS emb
+WHERE emb IS NOT NULL AND (canon IS NULL OR NOT ({canon_where}))
+WITH node, emb, vector.similarity.cosine(emb, $qvec) AS score
+ORDER BY score DESC
+LIMIT $k
+RETURN node {.chunk_id, embedding: emb} AS chunk, score
+"""
+
+def _filter_clause(filters: SearchFilters) -> Tuple[str, Dict]:
+    conds, params = [], {}
+    if filters.case_ids:
+        conds.append("node.case_id IN $f_case_ids"); params["f_case_ids"] = filters.case_ids
+    if filters.industries:
+        conds.append("node.industry IN $f_industries"); params["f_industries"] = filters.industries
+    if filters.year_from is not None:
+        conds.append("node.year >= $f_year_from"); params["f_year_from"] = filters.year_from
+    if filters.year_to is not None:
+        conds.append("node.year <= $f_year_to"); params["f_year_to"] = filters.year_to
+    if filters.tags:
+        conds.append("any(t IN node.tags WHERE t IN $f_tags)"); params["f_tags"] = filters.tags
+    return " AND ".join(conds), params
+
+def _filters_key(filters: Optional[SearchFilters]) -> str:
+    return "" if filters is None or filters.is_empty() else filters.model_dump_json()
+
+def _compact(rows: List[Dict]) -> List[Dict]:
+    # float32 arrays are ~5x smaller than lists of Python floats
+    for r in rows:
+        emb = r["chunk"].get("embedding")
+        if emb is not None:
+            r["chunk"]["embedding"] = np.asarray(emb, dtype=np.float32)
+    return rows
+
+async def _asearch(key: Tuple, query: str, filters: Optional[SearchFilters], **params) -> List[Dict]:
+    key = key + (_filters_key(filters), await aindex_version())
+    rows = SEARCH_CACHE.get(key)
+    if rows is None:
+        if filters is None or filters.is_empty():
+            rows = await afetch(query, **params)
+        else:
+            where, fparams = _filter_clause(filters)
+            query = query.replace("{where}", where).replace("{canon_where}", where.replace("node.", "canon."))
+            rows = await afetch(query, **params, **fparams)
+        rows = _compact(rows)
+        SEARCH_CACHE.set(key, rows)
+    return rows
 
-def vector(qvec: List[float], k: int):
-    with get_session() as s:
-        return s.run(FIND_VEC, qvec=qvec, k=k).data()
+async def afulltext(q: str, k: int, filters: Optional[SearchFilters] = None):
+    query = FIND_FTS if filters is None or filters.is_empty() else FIND_FTS_SCOPED
+    fts_index, _ = await aactive_indexes()
+    return await _asearch(("fts", normalize_query(q), k), query, filters, q=q, k=k, fts_index=fts_index)
+
+async def avector(qvec: List[float], k: int, filters: Optional[SearchFilters] = None):
+    query = FIND_VEC if filters is None or filters.is_empty() else FIND_VEC_SCOPED
+    digest = hashlib.blake2b(np.asarray(qvec, dtype=np.float32).tobytes(), digest_size=16).hexdigest()
+    _, vec_index = await aactive_indexes()
+    return await _asearch(("vec", digest, k), query, filters,
+                          qvec=[float(x) for x in qvec], k=k, vec_index=vec_index)
+
+def fulltext(q: str, k: int, filters: Optional[SearchFilters] = None):
+    return run(afulltext(q, k, filters))
+
+def vector(qvec: List[float], k: int, filters: Optional[SearchFilters] = None):
+    return run(avector(qvec, k, filters))
+
+LIST_FACETS = """
+MATCH (cs:CaseStudy)
+""" + CASE_META + """
+RETURN cs.case_id AS case_id, cs.title AS title, industry, year, tags
+ORDER BY title
+"""
+
+def list_facets() -> List[Dict]:
+    return fetch(LIST_FACETS)
 
 GET_CONTEXT = """
 
@@ -59,11 +351,55 @@ RETURN cs.case_id AS case_id, cs.title AS title, cs.url AS url,
        c.char_start AS s, c.char_end AS e
 """
 
-def get_context(chunk_id: str):
-    with get_session() as s:
-        return s.run(GET_CONTEXT, chunk_id=chunk_id).single()
+GET_CONTEXTS = """
+UNWIND $chunk_ids AS cid
+MATCH (cs:CaseStudy)-[:HAS_CHUNK]->(c:Chunk {chunk_id: cid})
+RETURN cs.case_id AS case_id, cs.title AS title, cs.url AS url,
+       c.chunk_id AS chunk_id, c.text AS text, c.order AS ord,
+       c.char_start AS s, c.char_end AS e
+"""
 
+async def aget_contexts(chunk_ids: List[str]) -> Dict[str, Dict]:
+    # Hydrates chunk records from the shared cache; misses are fetched in one query
+    version = await aindex_version()
+    out: Dict[str, Dict] = {}
+    missing = []
+    for cid in chunk_ids:
+        rec = CHUNK_CACHE.get((cid, version))
+        if rec is None:
+            missing.append(cid)
+        else:
+            out[cid] = rec
+    if missing:
+        for rec in await afetch(GET_CONTEXTS, chunk_ids=missing):
+            out[rec["chunk_id"]] = rec
+            CHUNK_CACHE.set((rec["chunk_id"], version), rec)
+    return out
 
+def get_contexts(chunk_ids: List[str]) -> Dict[str, Dict]:
+    return run(aget_contexts(chunk_ids))
 
+def get_context(chunk_id: str):
+    return get_contexts([chunk_id]).get(chunk_id)
+
+# ±k chunks around each hit, for all hits in one round trip (uses chunk_case_order_idx)
+GET_NEIGHBORS = """
+UNWIND $chunk_ids AS cid
+MATCH (hit:Chunk {chunk_id: cid})
+MATCH (n:Chunk {case_id: hit.case_id})
+WHERE n.order >= hit.order - $k AND n.order <= hit.order + $k
+RETURN cid AS hit_id, n.chunk_id AS chunk_id, n.text AS text, n.order AS ord,
+       n.char_start AS s, n.char_end AS e
+"""
 
+async def aneighbors(chunk_ids: List[str], k: int) -> List[Dict]:
+    # Shared with aget_contexts' cache: the same hits come back for repeated and popular questions
+    key = ("neighbors", tuple(sorted(chunk_ids)), k, await aindex_version())
+    rows = CHUNK_CACHE.get(key)
+    if rows is None:
+        rows = await afetch(GET_NEIGHBORS, chunk_ids=chunk_ids, k=k)
+        CHUNK_CACHE.set(key, rows)
+    return rows
 
+def neighbors(chunk_ids: List[str], k: int) -> List[Dict]:
+    return run(aneighbors(chunk_ids, k))
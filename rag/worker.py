@@ -0,0 +1,59 @@
+"""
+Ingestion worker: drains the SQLite job queue filled by the admin upload panel.
+
+    python -m rag.worker          # run forever
+    python -m rag.worker --once   # drain the queue and exit
+
+Each job is parsed once (the text is saved on the job), then embedded and
+written in batches; progress is checkpointed after every committed batch so
+an interrupted job resumes where it stopped. Several workers may run at once.
+"""
+import argparse, time, traceback
+from typing import Dict
+from config import JOB_POLL_S, JOB_STALE_S, JOB_MAX_ATTEMPTS
+from .aio import run
+from .loader import extract_text, chunk_records, aingest_records
+from .store import bump_index_version
+from . import jobs
+
+def process(job: Dict):
+    text = job["text"]
+    if text is None:
+        # OCR can outlast JOB_STALE_S with no batch to checkpoint; heartbeat per page instead
+        beat = lambda: jobs.heartbeat(job["id"], job["owner"])
+        text, report = extract_text(job["data"], job["kind"], on_page=beat)
+        recs = chunk_records(text, job["meta"])
+        jobs.save_text(job["id"], job["owner"], text, len(recs), report)
+    else:
+        recs = chunk_records(text, job["meta"])
+    run(aingest_records(
+        recs,
+        start=job["done_chunks"],
+        on_batch=lambda done, n: jobs.checkpoint(job["id"], job["owner"], done, n),
+    ))
+    bump_index_version()
+    jobs.finish(job["id"], job["owner"])
+
+def drain(once: bool = False):
+    while True:
+        job = jobs.claim(JOB_STALE_S)
+        if job is None:
+            if once:
+                return
+            time.sleep(JOB_POLL_S)
+            continue
+        try:
+            process(job)
+            print(f"job {job['id']} ({job['filename']}): done", flush=True)
+        except jobs.LeaseLost:
+            print(f"job {job['id']} ({job['filename']}): taken over by another worker, stopped", flush=True)
+        except Exception:
+            retry = job["attempts"] < JOB_MAX_ATTEMPTS
+            if not jobs.fail(job["id"], job["owner"], traceback.format_exc(), retry=retry):
+                continue
+            print(f"job {job['id']} ({job['filename']}): failed, {'requeued' if retry else 'giving up'}", flush=True)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Drain the ingestion job queue.")
+    ap.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    drain(once=ap.parse_args().once)